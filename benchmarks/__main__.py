@@ -0,0 +1,50 @@
+"""Run the benchmarks, optionally comparing them against a baseline.
+
+  $ python -m benchmarks --output report.json --baseline baseline.json
+
+The exit status is 1 if any benchmark is slower than its baseline by more
+than the threshold.
+
+"""
+import argparse
+import sys
+
+from benchmarks.suite import WORKLOADS, compare, load, run, save
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="benchmarks", description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("names", nargs="*", metavar="name",
+                        help="workloads to run, of: %s" % ", ".join(
+                            func.__name__ for func in WORKLOADS))
+    parser.add_argument("--scale", type=float, default=1.0,
+                        help="size of the workloads (default: 1)")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="times to run each workload (default: 3)")
+    parser.add_argument("--output", help="file to write the report to")
+    parser.add_argument("--baseline", help="report to compare against")
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="fraction by which a workload may be slower "
+                             "than its baseline (default: 0.25)")
+    args = parser.parse_args(argv)
+
+    report = run(args.names or None, args.scale, args.repeat)
+    for name, result in sorted(report["benchmarks"].items()):
+        print "%-20s %10.4fs" % (name, result["seconds"])
+    if args.output:
+        save(report, args.output)
+
+    if args.baseline:
+        regressions = compare(report, load(args.baseline), args.threshold)
+        for name, before, after in regressions:
+            print "%s regressed: %.4fs -> %.4fs (%+.0f%%)" % (
+                name, before, after, (after / before - 1) * 100)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
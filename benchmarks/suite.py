@@ -0,0 +1,188 @@
+from functools import partial
+import json
+import os
+import platform
+import shutil
+import tempfile
+import time
+
+from evil import expr_tokenizer, globlookup, strlookup
+from evil.maths import maths_batch_evil, maths_compile, maths_evil, numpy
+from evil.set import set_compile, set_evil
+
+# Workloads are generators taking a scale factor, which prepare their data
+# and yield a callable to time. Anything they create is removed once they are
+# closed.
+WORKLOADS = []
+
+
+def workload(func):
+    WORKLOADS.append(func)
+    return func
+
+
+@workload
+def flat_expression(scale):
+    """A long expression of unions with no brackets."""
+    n = int(10000 * scale) + 1
+    expr = " + ".join("p%d" % i for i in range(n))
+    lookup = lambda pattern: [pattern]
+    yield partial(set_evil, expr, lookup)
+
+
+@workload
+def nested_expression(scale):
+    """An expression of deeply nested brackets."""
+    n = int(2000 * scale) + 1
+    expr = "(" * n + "p" + "".join(" + p%d)" % i for i in range(n))
+    lookup = lambda pattern: [pattern]
+    yield partial(set_evil, expr, lookup)
+
+
+@workload
+def wide_tokenizer(scale):
+    """Tokenizing with a wide set of multi-character operators."""
+    symbols = "!#$%&*+-/<>=~^|"
+    operators = ["(", ")"] + [a + b for a in symbols for b in symbols]
+    n = int(20000 * scale) + 1
+    expr = " ".join("p%d %s" % (i, operators[2 + i % (len(operators) - 2)])
+                    for i in range(n)) + " p"
+    yield lambda: list(expr_tokenizer(expr, operators))
+
+
+@workload
+def strlookup_names(scale):
+    """strlookup over a space of a million names."""
+    space = ["name%07d" % i for i in range(int(1000000 * scale) + 1)]
+    yield partial(strlookup, "name*42*", space)
+
+
+@workload
+def globlookup_tree(scale):
+    """globlookup over a generated directory tree."""
+    root = tempfile.mkdtemp()
+    try:
+        width = max(2, int(20 * scale ** (1.0 / 3)))
+        for i in range(width):
+            for j in range(width):
+                path = os.path.join(root, "d%d" % i, "e%d" % j)
+                os.makedirs(path)
+                for k in range(width):
+                    open(os.path.join(path, "f%d.txt" % k), "w").close()
+        yield lambda: list(globlookup("d1*/e*/f1*.txt", root))
+    finally:
+        shutil.rmtree(root)
+
+
+def _sets(scale, count):
+    size = int(100000 * scale) + 1
+    return dict(
+        ("s%d" % i, set(range(i * size // 4, i * size // 4 + size)))
+        for i in range(count)
+    )
+
+
+@workload
+def set_union(scale):
+    """set_evil over the union of large sets."""
+    space = _sets(scale, 8)
+    plan = set_compile(" + ".join(sorted(space)))
+    yield partial(set_evil, plan, space.__getitem__)
+
+
+@workload
+def set_intersection(scale):
+    """set_evil over the intersection of large sets."""
+    space = _sets(scale, 3)
+    plan = set_compile(" = ".join(sorted(space)))
+    yield partial(set_evil, plan, space.__getitem__)
+
+
+@workload
+def maths_rows(scale):
+    """maths_evil of a compiled expression over many rows."""
+    plan = maths_compile("(a + b) * c - a / 2 ^ 2")
+    rows = [{"a": i, "b": i % 7, "c": 3, "2": 2}
+            for i in range(int(10000 * scale) + 1)]
+    yield lambda: [maths_evil(plan, row.__getitem__) for row in rows]
+
+
+@workload
+def maths_batch(scale):
+    """maths_batch_evil over columns of a million rows. Requires NumPy."""
+    if numpy is None:
+        return
+    n = int(1000000 * scale) + 1
+    columns = {
+        "a": numpy.arange(n, dtype=float),
+        "b": numpy.arange(n, dtype=float) % 7,
+        "c": numpy.full(n, 3.0),
+    }
+    plan = maths_compile("(a + b) * c - a / 2 ^ 2")
+    yield partial(maths_batch_evil, plan, columns)
+
+
+def run(names=None, scale=1.0, repeat=3, timer=time.time):
+    """run times each of the workloads, returning a report of the best time of
+    each.
+
+    :param names: The names of the workloads to run, or None to run them all.
+    :param scale: The size of the workloads relative to their full size.
+    :param repeat: The number of times to time each workload.
+    :param timer: A callable returning the current time in seconds.
+
+    """
+    results = {}
+    for func in WORKLOADS:
+        name = func.__name__
+        if names is not None and name not in names:
+            continue
+        gen = func(scale)
+        try:
+            bench = next(gen, None)
+            if bench is None:
+                continue
+            times = []
+            for _ in range(repeat):
+                start = timer()
+                bench()
+                times.append(timer() - start)
+        finally:
+            gen.close()
+        results[name] = {"seconds": min(times), "times": times}
+    return {
+        "python": platform.python_version(),
+        "scale": scale,
+        "repeat": repeat,
+        "benchmarks": results,
+    }
+
+
+def compare(report, baseline, threshold=0.25):
+    """compare returns the benchmarks of report which are slower than in
+    baseline by more than threshold, as (name, baseline seconds, seconds)
+    tuples. Benchmarks missing from either report are ignored.
+
+    :param threshold: The fraction by which a benchmark may slow down.
+
+    """
+    regressions = []
+    current = report["benchmarks"]
+    for name, before in sorted(baseline["benchmarks"].items()):
+        if name not in current:
+            continue
+        after = current[name]["seconds"]
+        if after > before["seconds"] * (1 + threshold):
+            regressions.append((name, before["seconds"], after))
+    return regressions
+
+
+def load(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def save(report, path):
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+        f.write("\n")
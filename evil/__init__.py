@@ -1,19 +1,71 @@
 #!/usr/bin/env python
-from collections import OrderedDict
+from collections import deque, namedtuple, OrderedDict
+from functools import partial
 import fnmatch
 import os
+import pickle
 import re
+import threading
+import time
+
+from evil.budget import _budgeted_apply, _budgeted_lookup, _budgeted_reduce
+from evil.cache import LRUCache, _materialize
+from evil.trace import (
+    _size,
+    _TimedIterator,
+    _traced_apply,
+    _traced_lookup,
+    _traced_reduce,
+)
+
+try:
+    import asyncio
+except ImportError:
+    try:
+        import trollius as asyncio
+    except ImportError:
+        asyncio = None
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
 
 # Operators which act on expressions to their right are OP_RIGHT operators.
 # Operators which act on expressions to their left are OP_LEFT operators.
 # Operators which act on both are OP_LEFT | OP_RIGHT = OP_BOTH.
 OP_LEFT, OP_RIGHT, OP_BOTH = 1, 2, 3
 
+# Compiled expressions are a list of nodes in evaluation order. NODE_LOOKUP
+# nodes are patterns passed to the lookup, NODE_APPLY nodes are operator
+# applications and NODE_REDUCE nodes are (sub)expressions passed to the
+# reducer. The args of a node are the indexes of the nodes it consumes.
+NODE_LOOKUP, NODE_APPLY, NODE_REDUCE = 1, 2, 3
+
+Node = namedtuple("Node", "kind token func side args")
+
+# The whitespace separating tokens.
+_WHITESPACE = " \t\n\r\f\v"
+
+# The characters which make a glob pattern more than a literal string.
+_GLOB_MAGIC = re.compile(r"[*?[]")
+
+# The tokenizer grammars of the most recently used operator sets.
+_grammars = LRUCache(maxsize=64)
+
+# The Plans of the most recently evaluated expressions.
+_plans = LRUCache(maxsize=64)
 
-def evil(expr, lookup, operators, cast, reducer, tokenizer):
+
+def evil(expr, lookup, operators, cast, reducer, tokenizer, executor=None,
+         pure=None, tracer=None, budget=None):
     """evil evaluates an expression according to the eval description given.
 
-    :param expr: An expression to evaluate.
+    :param expr: An expression to evaluate, or a Plan returned by compile, in
+                 which case operators and tokenizer are ignored.
     :param lookup: A callable which takes a single pattern argument and returns
                    a set of results. The pattern can be anything that is not an
                    operator token or round brackets.
@@ -28,32 +80,166 @@ def evil(expr, lookup, operators, cast, reducer, tokenizer):
     :param tokenizer: A callable which will break the query into tokens for
                       evaluation per the lookup and operators. Defaults to
                       setquery.query_tokenizer.
-    :raises: SyntaxError
+    :param executor: A concurrent.futures executor with which to evaluate
+                     independent lookups and subexpressions in parallel. With
+                     a process pool, the lookup, cast, reducer and operators
+                     must be picklable.
+    :param pure: The tokens of operators which are pure, per Plan.share. If
+                 any are given, identical subexpressions are evaluated once.
+    :param tracer: An evil.trace.Tracer to give the time spent compiling the
+                   expression and in each lookup, operator and reduction.
+    :param budget: An evil.budget.Budget limiting the time, lookups and sizes
+                   of the evaluation.
+    :raises: SyntaxError, evil.budget.BudgetExceeded
     :returns:
 
+    """
+    if not isinstance(expr, Plan):
+        expr = _compile_cached(expr, operators, tokenizer, pure, tracer)
+    return expr.evaluate(lookup, cast, reducer, executor, tracer, budget)
+
+
+def _compile_cached(expr, operators, tokenizer, pure, tracer):
+    # Reuse the Plan of a recent evaluation of the same string. Traced
+    # compilations are not reused, so that the tracer is given their time.
+    if tracer is not None or not isinstance(expr, basestring):
+        return compile(expr, operators, tokenizer, pure=pure, tracer=tracer)
+    operators = tuple(operators)
+    key = (expr, operators, tokenizer, tuple(pure or ()))
+    try:
+        plan = _plans.get(key)
+    except TypeError:
+        # The functions of the operators cannot be hashed.
+        return compile(expr, operators, tokenizer, pure=pure)
+    if plan is None:
+        plan = compile(expr, operators, tokenizer, pure=pure)
+        _plans.set(key, plan)
+    return plan
+
+
+def evil_many(exprs, lookup, operators, cast, reducer, tokenizer,
+              executor=None, pure=None, tracer=None, budget=None):
+    """evil_many evaluates several expressions as evil does, in a single
+    evaluation which can share identical subexpressions between them.
+
+    :param exprs: An iterable of expressions or Plans.
+    :param pure: The tokens of operators which are pure, per Plan.share. If
+                 any are given, each distinct pattern is looked up once and
+                 identical applications of them are evaluated once.
+    :returns: a list of the results of each expression. Identical results may
+              be the same object.
+
+    """
+    plans = [
+        expr if isinstance(expr, Plan)
+        else compile(expr, operators, tokenizer, tracer=tracer)
+        for expr in exprs
+    ]
+    plan = Plan.merge(plans).share(pure or ())
+    return plan.evaluate_all(lookup, cast, reducer, executor, tracer, budget)
+
+
+def evil_async(expr, lookup, operators, cast, reducer, tokenizer, limit=None,
+               loop=None):
+    """evil_async evaluates an expression as evil does, making its lookups
+    concurrently. It requires asyncio, or trollius on Python 2.
+
+    :param lookup: A callable which takes a single pattern argument and returns
+                   a coroutine or future of its results, or the results.
+                   Each distinct pattern is looked up once.
+    :param limit: The maximum number of lookups to run at once, or None.
+    :param loop: The event loop to run lookups in. Defaults to the current
+                 event loop.
+    :returns: an asyncio Future of the result.
+
+    """
+    if asyncio is None:
+        raise ImportError("evil_async requires asyncio or trollius")
+    if not isinstance(expr, Plan):
+        expr = compile(expr, operators, tokenizer)
+    return expr.evaluate_async(lookup, cast, reducer, limit, loop)
+
+
+def explain(expr, operators, tokenizer):
+    """explain returns the tree of operators and lookups an expression is
+    parsed into, as an Explanation.
+
+    :param expr: An expression, or a Plan returned by compile, in which case
+                 operators and tokenizer are ignored.
+    :raises: SyntaxError
+
+    """
+    if not isinstance(expr, Plan):
+        expr = compile(expr, operators, tokenizer)
+    return expr.explain()
+
+
+def analyze(expr, lookup, operators, cast, reducer, tokenizer, timer=None):
+    """analyze evaluates an expression as evil does, returning its
+    Explanation with the size of the value of each node and the time taken
+    to find it.
+
+    :param timer: A callable returning the current time in seconds.
+    :raises: SyntaxError
+
+    """
+    if not isinstance(expr, Plan):
+        expr = compile(expr, operators, tokenizer)
+    return expr.analyze(lookup, cast, reducer, timer)
+
+
+def compile(expr, operators, tokenizer, engine=None, pure=None,
+            tracer=None):
+    """compile parses an expression into a Plan which can be evaluated many
+    times without tokenizing or parsing the expression again.
+
+    :param expr: An expression to compile.
+    :param operators: A precedence-ordered list of (token, function, side)
+                      tuples, as returned by op.
+    :param tokenizer: A callable which will break the query into tokens.
+    :param engine: The name of the function in ENGINES used to apply the
+                   operators of each (sub)expression by precedence. Defaults
+                   to "linear".
+    :param pure: The tokens of operators which are pure, per Plan.share. If
+                 any are given, identical subexpressions are evaluated once.
+    :param tracer: An evil.trace.Tracer to give the time spent tokenizing and
+                   parsing the expression.
+    :raises: SyntaxError, ValueError
+    :returns: a Plan.
+
     """
     operators = OrderedDict((op[0], op[1:]) for op in operators)
     if "(" in operators or ")" in operators:
         raise ValueError("( and ) are reserved operators")
+    precedence = ENGINES[engine or "linear"]
 
-    operator_tokens = ["(", ")"] + operators.keys()
-    tokens = iter(tokenizer(expr, operator_tokens))
+    operator_tokens = ["(", ")"] + list(operators)
+    if tracer is None:
+        tokens = iter(tokenizer(expr, operator_tokens))
+    else:
+        source, start = expr, tracer.timer()
+        tokens = _TimedIterator(tracer.timer, tokenizer, expr,
+                                operator_tokens)
+    nodes = []
     levels = [[]]
 
+    def apply_op(op, *args):
+        nodes.append(Node(NODE_APPLY, op, operators[op][0], operators[op][1],
+                          args))
+        return len(nodes) - 1
+
     while True:
-        # Token evaluation and pattern lookups
+        # Token parsing and pattern nodes
 
         expr = levels.pop()           # The currently-constructed expression
         new_level = False             # We should step into a subexpression
         first_token = len(expr) == 0  # The first (sub)exp. token
 
         prev_op_side = None           # The side of the last-seen operator
-        try:
-            # Try to get the side of the last operator from an expression
-            # which we are going to continue constructing.
+        if expr and not isinstance(expr[-1], int):
+            # Get the side of the last operator from an expression which we
+            # are going to continue constructing.
             prev_op_side = operators[expr[-1]][1]
-        except:
-            pass
 
         for token in tokens:
 
@@ -77,7 +263,8 @@ def evil(expr, lookup, operators, cast, reducer, tokenizer):
                 prev_op_side = op_side
                 continue
             else:
-                expr.append(cast(lookup(token)))
+                nodes.append(Node(NODE_LOOKUP, token, None, None, ()))
+                expr.append(len(nodes) - 1)
                 prev_op_side = None
 
             first_token = False
@@ -91,50 +278,572 @@ def evil(expr, lookup, operators, cast, reducer, tokenizer):
                               "right or both sides cannot be at the end of "
                               "an expression.")
 
-        # Operator evaluation
+        # Operator precedence
+
+        expr = precedence(expr, operators, apply_op)
+        nodes.append(Node(NODE_REDUCE, None, None, None, tuple(expr)))
+        if len(levels) > 0:
+            levels[-1].append(len(nodes) - 1)
+        else:
+            break
+
+    if tracer is not None:
+        elapsed = tracer.timer() - start
+        tracer.compiled(source, tokens.seconds, elapsed - tokens.seconds)
+
+    plan = Plan(nodes)
+    return plan if pure is None else plan.share(pure)
+
+
+def rescan_precedence(expr, operators, apply_op):
+    """rescan_precedence applies the operators of an expression by rescanning
+    it once for each operator, in order of precedence.
+
+    :param expr: A list of node indexes and operator tokens.
+    :param operators: A precedence-ordered dictionary of (function, side)
+                      tuples keyed on the operator token.
+    :param apply_op: A callable taking an operator token and the node indexes
+                     of its operands, returning the node index of the result.
+    :raises: SyntaxError
+    :returns: a list of the node indexes remaining for the reducer.
+
+    """
+    def operand(t):
+        # Operators consume the nodes beside them. Anything else beside them
+        # is an operator which has not been applied yet.
+        if t < 0 or t >= len(expr) or not isinstance(expr[t], int):
+            raise _precedence_error()
+        return expr[t]
+
+    explen = len(expr)
+    for op, (op_eval, op_side) in operators.items():
+        if op_side is OP_RIGHT:
 
-        explen = len(expr)
-        for op, (op_eval, op_side) in operators.iteritems():
-            if op_side is OP_RIGHT:
+            # Apply right-sided operators. We loop from the end backward so
+            # that multiple such operators next to noe another are resolved
+            # in the correct order
+            t = explen - 1
+            while t >= 0:
+                if expr[t] == op:
+                    expr[t] = apply_op(op, operand(t + 1))
+                    del expr[t + 1]
+                    explen -= 1
+                t -= 1
 
-                # Apply right-sided operators. We loop from the end backward so
-                # that multiple such operators next to noe another are resolved
-                # in the correct order
-                t = explen - 1
-                while t >= 0:
-                    if expr[t] == op:
-                        expr[t] = op_eval(expr[t + 1])
-                        del expr[t + 1]
+        else:
+
+            # Apply left- and both-sided operators. We loop forward so that
+            # that multiple such operators next to one another are resolved
+            # in the correct order.
+            t = 0
+            while t < explen:
+                if expr[t] == op:
+                    # Apply left- or both-sided operators
+                    if op_side is OP_LEFT:
+                        expr[t] = apply_op(op, operand(t - 1))
+                        del expr[t - 1]
+                        t -= 1
                         explen -= 1
-                    t -= 1
+                    elif op_side is OP_BOTH:
+                        expr[t] = apply_op(op, operand(t - 1),
+                                           operand(t + 1))
+                        del expr[t + 1], expr[t - 1]
+                        t -= 1
+                        explen -= 2
+                t += 1
+
+    return expr
+
 
+def linear_precedence(expr, operators, apply_op):
+    """linear_precedence applies the operators of an expression in a single
+    pass, with operator and operand stacks. It is equivalent to
+    rescan_precedence.
+
+    :param expr: A list of node indexes and operator tokens.
+    :param operators: A precedence-ordered dictionary of (function, side)
+                      tuples keyed on the operator token.
+    :param apply_op: A callable taking an operator token and the node indexes
+                     of its operands, returning the node index of the result.
+    :raises: SyntaxError
+    :returns: a list of the node indexes remaining for the reducer.
+
+    """
+    rank = dict((op, r) for r, op in enumerate(operators))
+    reduced = []   # The node indexes for the reducer
+    values = []    # The operands of the current value
+    ops = []       # The right- and both-sided operators awaiting operands
+    prev = None    # The previous item, if it was an operator
+
+    def unwind(r):
+        # Apply the awaiting operators of precedence r or higher
+        while ops and rank[ops[-1]] <= r:
+            op = ops.pop()
+            if operators[op][1] is OP_RIGHT:
+                values[-1] = apply_op(op, values[-1])
             else:
+                right = values.pop()
+                values[-1] = apply_op(op, values[-1], right)
 
-                # Apply left- and both-sided operators. We loop forward so that
-                # that multiple such operators next to one another are resolved
-                # in the correct order.
-                t = 0
-                while t < explen:
-                    if expr[t] == op:
-                        # Apply left- or both-sided operators
-                        if op_side is OP_LEFT:
-                            expr[t] = op_eval(expr[t - 1])
-                            del expr[t - 1]
-                            t -= 1
-                            explen -= 1
-                        elif op_side is OP_BOTH:
-                            expr[t] = op_eval(expr[t - 1], expr[t + 1])
-                            del expr[t + 1], expr[t - 1]
-                            t -= 1
-                            explen -= 2
-                    t += 1
+    for item in expr:
+        if isinstance(item, int):
+            if prev is None or operators[prev][1] is OP_LEFT:
+                # Values side-by-side are separately reduced
+                unwind(len(rank))
+                reduced.extend(values)
+                del values[:]
+            values.append(item)
+            prev = None
+            continue
 
-        if len(levels) > 0:
-            levels[-1].append(reducer(expr))
-        else:
-            break
+        op_side = operators[item][1]
+        if prev is not None and operators[prev][1] & OP_RIGHT:
+            # Right-sided operators are applied to the right-sided operators
+            # that follow them, and so must not precede them.
+            if rank[prev] < rank[item]:
+                raise _precedence_error()
+        elif prev is not None and op_side & OP_LEFT:
+            # Left-sided operators apply to the left-sided operators that
+            # precede them, and so must not precede them.
+            if rank[item] < rank[prev]:
+                raise _precedence_error()
+
+        if op_side is OP_RIGHT:
+            if prev is None and values or \
+                    prev is not None and operators[prev][1] is OP_LEFT:
+                unwind(len(rank))
+                reduced.extend(values)
+                del values[:]
+            ops.append(item)
+        elif op_side is OP_LEFT:
+            unwind(rank[item])
+            values[-1] = apply_op(item, values[-1])
+        elif op_side is OP_BOTH:
+            unwind(rank[item])
+            ops.append(item)
+        prev = item
+
+    unwind(len(rank))
+    reduced.extend(values)
+    return reduced
+
+
+def _precedence_error():
+    return SyntaxError("Operators cannot be applied to operators of lower "
+                       "precedence beside them.")
+
+
+# The functions which compile can use to apply operators by precedence.
+ENGINES = {
+    "linear": linear_precedence,
+    "rescan": rescan_precedence,
+}
+
+
+class Plan(object):
+    """Plan is a compiled expression, evaluated against the lookup, cast and
+    reducer given to evaluate.
+
+    :param nodes: A list of Nodes in evaluation order, the last of which is
+                  the result of the expression.
+    :param roots: The indexes of the nodes whose values are the results of
+                  the plan. Defaults to the last node.
+
+    """
+
+    def __init__(self, nodes, roots=None):
+        self.nodes = tuple(nodes)
+        if roots is None:
+            roots = [len(self.nodes) - 1]
+        self.roots = tuple(roots)
+
+    @classmethod
+    def merge(cls, plans):
+        """merge returns a Plan whose results are those of each of plans."""
+        nodes, roots = [], []
+        for plan in plans:
+            offset = len(nodes)
+            nodes.extend(
+                node._replace(args=tuple(a + offset for a in node.args))
+                for node in plan.nodes
+            )
+            roots.extend(root + offset for root in plan.roots)
+        return cls(nodes, roots)
+
+    def share(self, pure=()):
+        """share returns an equivalent Plan in which identical lookups,
+        reductions and applications of pure operators are evaluated once.
+
+        Values are only shared between the reducer and pure operators, which
+        must not modify their arguments. Without any pure operators nothing
+        is shared, and the plan itself is returned.
+
+        :param pure: The tokens of operators whose results depend only on
+                     their arguments, and which do not modify them.
+
+        """
+        pure = frozenset(pure)
+        if not pure:
+            return self
+        private = [False] * len(self.nodes)
+        for node in self.nodes:
+            if node.kind == NODE_APPLY and node.token not in pure:
+                for a in node.args:
+                    private[a] = True
+
+        nodes = []
+        shared = {}    # The new node index of each key
+        index = []     # The new node index of each original node
+        for i, node in enumerate(self.nodes):
+            node = node._replace(args=tuple(index[a] for a in node.args))
+            if private[i] or (node.kind == NODE_APPLY and
+                              node.token not in pure):
+                key = i
+            else:
+                key = (node.kind, node.token, node.args)
+            if key not in shared:
+                shared[key] = len(nodes)
+                nodes.append(node)
+            index.append(shared[key])
+
+        return Plan(nodes, [index[root] for root in self.roots])
+
+    def traced(self, tracer):
+        """traced returns an equivalent Plan whose operators give their
+        timings to tracer."""
+        return Plan([
+            node._replace(func=partial(_traced_apply, tracer, node.token,
+                                       node.func))
+            if node.kind == NODE_APPLY else node
+            for node in self.nodes
+        ], self.roots)
+
+    def budgeted(self, allowance):
+        """budgeted returns an equivalent Plan whose operators are checked
+        against allowance, an evil.budget.Allowance."""
+        return Plan([
+            node._replace(func=partial(_budgeted_apply, allowance, node.func))
+            if node.kind == NODE_APPLY else node
+            for node in self.nodes
+        ], self.roots)
+
+    def explain(self):
+        """explain returns the Explanation of the last root of the plan."""
+        return self._explain([None] * len(self.nodes),
+                             [None] * len(self.nodes))
+
+    def analyze(self, lookup, cast, reducer, timer=None):
+        """analyze evaluates the plan, returning the Explanation of its last
+        root with the size and evaluation time of each node."""
+        timer = timer or time.time
+        scope = getattr(lookup, "scope", None)
+        if scope is not None:
+            lookup = scope()
+
+        values = [None] * len(self.nodes)
+        sizes = [None] * len(self.nodes)
+        seconds = [None] * len(self.nodes)
+        for i, node in enumerate(self.nodes):
+            start = timer()
+            if node.kind == NODE_LOOKUP:
+                value = cast(lookup(node.token))
+            elif node.kind == NODE_APPLY:
+                value = node.func(*[values[a] for a in node.args])
+            else:
+                value = reducer([values[a] for a in node.args])
+            seconds[i] = timer() - start
+            sizes[i] = _size(value)
+            values[i] = value
+        return self._explain(sizes, seconds)
+
+    def _explain(self, sizes, seconds):
+        explanations = []
+        for i, node in enumerate(self.nodes):
+            explanations.append(Explanation(
+                _NODE_KINDS[node.kind], node.token, _OP_SIDES.get(node.side),
+                [explanations[a] for a in node.args], sizes[i], seconds[i]
+            ))
+        return explanations[self.roots[-1]]
+
+    def patterns(self):
+        """patterns returns the patterns looked up by the plan, in order."""
+        return [n.token for n in self.nodes if n.kind == NODE_LOOKUP]
+
+    def uses(self):
+        """uses returns the number of times each node's value is used, as an
+        argument of other nodes or a result of the plan."""
+        uses = [0] * len(self.nodes)
+        for node in self.nodes:
+            for a in node.args:
+                uses[a] += 1
+        for root in self.roots:
+            uses[root] += 1
+        return uses
+
+    def evaluate(self, lookup, cast, reducer, executor=None, tracer=None,
+                 budget=None):
+        """evaluate calculates the result of the plan.
+
+        :param lookup: As given to evil.
+        :param cast: As given to evil.
+        :param reducer: As given to evil.
+        :param executor: As given to evil.
+        :param tracer: As given to evil.
+        :param budget: As given to evil.
+
+        """
+        return self.evaluate_all(lookup, cast, reducer, executor, tracer,
+                                 budget)[-1]
+
+    def evaluate_all(self, lookup, cast, reducer, executor=None,
+                     tracer=None, budget=None):
+        """evaluate_all calculates the results of the plan, as evaluate does,
+        returning the value of each of its roots."""
+        # Lookups such as evil.cache.CachedLookup can share their results
+        # between the patterns of a single evaluation.
+        scope = getattr(lookup, "scope", None)
+        if scope is not None:
+            lookup = scope()
+        if budget is not None:
+            allowance = budget.start()
+            return self.budgeted(allowance).evaluate_all(
+                partial(_budgeted_lookup, allowance, lookup, cast), _identity,
+                partial(_budgeted_reduce, allowance, reducer), executor,
+                tracer)
+        if tracer is not None:
+            return self.traced(tracer).evaluate_all(
+                partial(_traced_lookup, tracer, lookup, cast), _identity,
+                partial(_traced_reduce, tracer, reducer), executor)
+        if executor is not None:
+            return self._evaluate_parallel(lookup, cast, reducer, executor)
+
+        uses = self.uses()
+        values = [None] * len(self.nodes)
+        for i, node in enumerate(self.nodes):
+            if node.kind == NODE_LOOKUP:
+                value = cast(lookup(node.token))
+            elif node.kind == NODE_APPLY:
+                value = node.func(*[values[a] for a in node.args])
+            else:
+                value = reducer([values[a] for a in node.args])
+
+            # Release arguments once they have been used for the last time
+            for a in node.args:
+                uses[a] -= 1
+                if not uses[a]:
+                    values[a] = None
+            values[i] = value
+
+        return [values[root] for root in self.roots]
+
+    def _evaluate_parallel(self, lookup, cast, reducer, executor):
+        # Submit each node to the executor once its arguments are evaluated.
+        # After an error only the nodes before it are evaluated, so that the
+        # error raised is the first that evaluate would have raised.
+        from concurrent.futures import (
+            FIRST_COMPLETED,
+            ProcessPoolExecutor,
+            wait,
+        )
+
+        nodes = self.nodes
+        if isinstance(executor, ProcessPoolExecutor):
+            _check_picklable([lookup, cast, reducer] + [
+                node.func for node in nodes if node.kind == NODE_APPLY
+            ])
+        uses = self.uses()
+        values = [None] * len(nodes)
+        waiting = [len(node.args) for node in nodes]
+        consumers = [[] for node in nodes]
+        for i, node in enumerate(nodes):
+            for a in node.args:
+                consumers[a].append(i)
+
+        running = {}
+        errors = {}
+
+        def submit(i):
+            node = nodes[i]
+            args = [values[a] for a in node.args]
+            for a in node.args:
+                uses[a] -= 1
+                if not uses[a]:
+                    values[a] = None
+            if node.kind == NODE_LOOKUP:
+                future = executor.submit(_lookup, lookup, cast, node.token)
+            elif node.kind == NODE_APPLY:
+                future = executor.submit(node.func, *args)
+            else:
+                future = executor.submit(reducer, args)
+            running[future] = i
 
-    return reducer(expr)
+        for i, count in enumerate(waiting):
+            if count == 0:
+                submit(i)
+
+        while running:
+            done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+            for future in done:
+                i = running.pop(future)
+                try:
+                    values[i] = future.result()
+                except Exception as e:
+                    errors[i] = e
+                    continue
+                for c in consumers[i]:
+                    waiting[c] -= 1
+                    if waiting[c] == 0 and (not errors or c < min(errors)):
+                        submit(c)
+
+        if errors:
+            raise errors[min(errors)]
+        return [values[root] for root in self.roots]
+
+    def evaluate_async(self, lookup, cast, reducer, limit=None, loop=None):
+        """evaluate_async calculates the result of the plan once the results
+        of its lookups, which are made concurrently, are available.
+
+        :param lookup: As given to evil_async.
+        :param cast: As given to evil.
+        :param reducer: As given to evil.
+        :param limit: As given to evil_async.
+        :param loop: As given to evil_async.
+        :returns: an asyncio Future of the result.
+
+        """
+        if loop is None:
+            loop = asyncio.get_event_loop()
+        result = asyncio.Future(loop=loop)
+        patterns = iter(OrderedDict.fromkeys(self.patterns()))
+        results = {}   # The results of completed lookups
+        running = {}   # The futures of lookups in progress
+
+        def start():
+            # Start lookups until limit are running or none are left
+            for pattern in patterns:
+                try:
+                    value = lookup(pattern)
+                except Exception as e:
+                    return result.set_exception(e)
+                try:
+                    future = asyncio.ensure_future(value, loop=loop)
+                except TypeError:
+                    results[pattern] = _materialize(value)
+                    continue
+                running[pattern] = future
+                future.add_done_callback(partial(done, pattern))
+                if limit is not None and len(running) >= limit:
+                    return
+
+            if not running and not result.done():
+                try:
+                    value = self.evaluate(results.__getitem__, cast, reducer)
+                except Exception as e:
+                    return result.set_exception(e)
+                result.set_result(value)
+
+        def done(pattern, future):
+            del running[pattern]
+            if result.done():
+                return
+            elif future.cancelled():
+                result.cancel()
+            elif future.exception() is not None:
+                result.set_exception(future.exception())
+            else:
+                results[pattern] = _materialize(future.result())
+                start()
+
+        def finished(result):
+            # Lookups are abandoned when the evaluation fails or is cancelled
+            for future in list(running.values()):
+                future.cancel()
+
+        result.add_done_callback(finished)
+        start()
+        return result
+
+
+class Explanation(object):
+    """Explanation is a node of the tree an expression is parsed into.
+
+    :param kind: "lookup", "apply" or "reduce".
+    :param token: The pattern of a lookup or the token of an operator.
+    :param side: The side of an operator: "left", "right" or "both".
+    :param children: The Explanations of the arguments of the node.
+    :param size: The size of the value of the node when analyzed, if it has
+                 one.
+    :param seconds: The time taken to find the value of the node when
+                    analyzed, excluding the time taken by its children.
+
+    """
+
+    def __init__(self, kind, token, side, children, size=None, seconds=None):
+        self.kind = kind
+        self.token = token
+        self.side = side
+        self.children = children
+        self.size = size
+        self.seconds = seconds
+
+    def __str__(self):
+        return "\n".join(self.lines())
+
+    def lines(self, indent=""):
+        """lines returns the lines of text describing the tree."""
+        line = indent + self.kind
+        if self.kind == "lookup":
+            line += " %s" % self.token
+        elif self.kind == "apply":
+            line += " %s (%s)" % (self.token, self.side)
+        if self.size is not None:
+            line += " size=%d" % self.size
+        if self.seconds is not None:
+            line += " time=%.3fms" % (self.seconds * 1000)
+        lines = [line]
+        for child in self.children:
+            lines.extend(child.lines(indent + "  "))
+        return lines
+
+    def as_dict(self):
+        """as_dict returns the tree as nested dictionaries."""
+        return {
+            "kind": self.kind,
+            "token": self.token,
+            "side": self.side,
+            "size": self.size,
+            "seconds": self.seconds,
+            "children": [child.as_dict() for child in self.children],
+        }
+
+
+_NODE_KINDS = {NODE_LOOKUP: "lookup", NODE_APPLY: "apply",
+               NODE_REDUCE: "reduce"}
+
+_OP_SIDES = {OP_LEFT: "left", OP_RIGHT: "right", OP_BOTH: "both"}
+
+
+def _lookup(lookup, cast, pattern):
+    return cast(lookup(pattern))
+
+
+def _check_picklable(objs):
+    # A process pool loses the error of a task which cannot be pickled, and
+    # the task never completes, so check each callable before submitting any.
+    checked = {}
+    for obj in objs:
+        if id(obj) in checked:
+            continue
+        checked[id(obj)] = obj
+        try:
+            pickle.dumps(obj, pickle.HIGHEST_PROTOCOL)
+        except Exception as e:
+            raise TypeError("%r cannot be pickled, as a process pool "
+                            "requires: %s" % (obj, e))
+
+
+def _identity(value):
+    return value
 
 
 def expr_tokenizer(expr, operator_tokens):
@@ -143,22 +852,151 @@ def expr_tokenizer(expr, operator_tokens):
     Tokens are split by whitespace which is never considered a token in its
     own right. operator_tokens should likely include "(" and ")" and strictly
     the expression. This means that the word 'test' will be split into ['t',
-    'e', 'st'] if 'e' is an operator.
+    'e', 'st'] if 'e' is an operator. Where operators overlap the longest is
+    preferred.
 
-    :param expr: The expression to break into tokens.
+    :param expr: The expression to break into tokens. Large expressions can
+                 be given as a file-like object or an iterable of strings and
+                 will be tokenized as they are read.
     :param operator_tokens: A list of operators to extract as tokens.
     """
-    operator_tokens.sort(key=len, reverse=True)
-    for m in re.finditer(
-        r"""(\s+) |            # Whitespace
-            ({0}) |            # Operators
-            (.+?)(?={0}|\s|$)  # Patterns
-            """.format("|".join(re.escape(op) for op in operator_tokens)),
-        expr, re.X
-    ):
-        token = m.group(2) or m.group(3)
-        if token:
-            yield token
+    return tokenizer_grammar(operator_tokens).tokens(expr)
+
+
+def tokenizer_grammar(operator_tokens):
+    """tokenizer_grammar returns the TokenizerGrammar for the given operators,
+    reusing those of recently-seen operator sets.
+
+    :param operator_tokens: An iterable of operators to extract as tokens.
+
+    """
+    key = frozenset(operator_tokens)
+    grammar = _grammars.get(key)
+    if grammar is None:
+        grammar = TokenizerGrammar(key)
+        _grammars.set(key, grammar)
+    return grammar
+
+
+class TokenizerGrammar(object):
+    """TokenizerGrammar splits expressions into tokens in a single pass,
+    matching operators with a trie.
+
+    :param operator_tokens: An iterable of operators to extract as tokens.
+
+    """
+
+    def __init__(self, operator_tokens):
+        self.trie = {}
+        self.longest = 1
+        for token in operator_tokens:
+            if not token:
+                continue
+            node = self.trie
+            for c in token:
+                node = node.setdefault(c, {})
+            node[None] = token
+            self.longest = max(self.longest, len(token))
+
+        # Tokens can only end where whitespace or an operator begins.
+        self.stop = re.compile("([%s]+)|[%s]" % (
+            re.escape(_WHITESPACE),
+            "".join(re.escape(c) for c in self.trie) or "^\\s\\S",
+        ))
+
+        # Where every operator is a single character, each of them is a token
+        # wherever it appears, so a string is split by a single regex.
+        self.split = None
+        if self.longest == 1:
+            ops = "".join(re.escape(c) for c in self.trie)
+            pattern = "[^%s%s]+" % (re.escape(_WHITESPACE), ops)
+            if ops:
+                pattern = "[%s]|%s" % (ops, pattern)
+            self.split = re.compile(pattern).findall
+
+    def match(self, expr, i):
+        """match returns the longest operator at expr[i:], or None."""
+        node, token = self.trie, None
+        for c in expr[i:i + self.longest]:
+            node = node.get(c)
+            if node is None:
+                break
+            token = node.get(None, token)
+        return token
+
+    def tokens(self, expr):
+        """tokens returns an iterator over the tokens of expr, which can be a
+        string, a file-like object or an iterable of strings."""
+        if self.split is not None and isinstance(expr, basestring):
+            return iter(self.split(expr))
+        return self._tokens(expr)
+
+    def _tokens(self, expr):
+        if isinstance(expr, basestring):
+            chunks = iter((expr,))
+        elif hasattr(expr, "read"):
+            chunks = _read_chunks(expr)
+        else:
+            chunks = iter(expr)
+
+        search, match, longest = self.stop.search, self.match, self.longest
+        buf = ""       # The expression read so far and not yet tokenized
+        n = 0          # The length of buf
+        i = 0          # The position of buf being tokenized
+        start = None   # The start of the pattern being read
+        eof = False
+        while True:
+            if not eof and n - i < longest:
+                # Read ahead far enough to match the longest operator
+                chunk = next(chunks, None)
+                if chunk is None:
+                    eof = True
+                else:
+                    cut = i if start is None else start
+                    buf, i = buf[cut:] + chunk, i - cut
+                    n = len(buf)
+                    if start is not None:
+                        start = 0
+                continue
+
+            m = search(buf, i)
+            j = n if m is None else m.start()
+            if j > i and start is None:
+                start = i
+            if m is None or (not eof and n - j < longest):
+                if m is None and eof:
+                    break
+                i = j
+                continue
+
+            if m.group(1) is None:
+                token = match(buf, j)
+                if token is None:
+                    # An operator's first character, but not the operator
+                    if start is None:
+                        start = j
+                    i = j + 1
+                    continue
+
+            if start is not None:
+                yield buf[start:j]
+                start = None
+            if m.group(1) is None:
+                yield token
+                i = j + len(token)
+            else:
+                i = m.end()
+
+        if start is not None:
+            yield buf[start:]
+
+
+def _read_chunks(fh, size=65536):
+    while True:
+        chunk = fh.read(size)
+        if not chunk:
+            return
+        yield chunk
 
 
 def op(token, func, left=False, right=False):
@@ -194,12 +1032,354 @@ def globlookup(pattern, root):
     """globlookup finds filesystem objects whose relative path matches the
     given pattern.
 
+    Paths are found in sorted order, skipping directories whose relative path
+    cannot begin any match of the pattern.
+
     :param pattern: The pattern to wish to match relative filepaths to.
     :param root: The root director to search within.
 
     """
-    for subdir, dirnames, filenames in os.walk(root):
-        d = subdir[len(root) + 1:]
-        files = (os.path.join(d, f) for f in filenames)
-        for f in fnmatch.filter(files, pattern):
-            yield f
+    glob = GlobPattern(pattern)
+    d, states = glob.start(root)
+    return _walk_glob(glob, d, states, partial(_listdir_within, root))
+
+
+def parallel_globlookup(pattern, root, workers=4, ordered=False,
+                        maxsize=64):
+    """parallel_globlookup finds filesystem objects whose relative path
+    matches the given pattern, as globlookup does, listing and matching
+    directories in a pool of threads.
+
+    Each thread walks its own share of the tree depth-first, taking the
+    shallowest waiting directories of other threads when it runs out.
+
+    :param pattern: As given to globlookup.
+    :param root: As given to globlookup.
+    :param workers: The number of threads to walk the tree with.
+    :param ordered: Whether to find paths in sorted order, as globlookup
+                    does, rather than as they are found. Directories listed
+                    early are kept until their turn.
+    :param maxsize: The number of directory listings which can wait to be
+                    read before the threads stop to wait for them.
+
+    """
+    glob = GlobPattern(pattern)
+    d, states = glob.start(root)
+    if not states:
+        return iter(())
+    walk = _ParallelWalk(glob, partial(_listdir_within, root), workers,
+                         maxsize)
+    return walk.ordered(d, states) if ordered else walk.unordered(d, states)
+
+
+def _walk_glob(glob, d, states, listdir):
+    # Find the paths matching glob within the relative directory d, whose
+    # entries are listed by listdir. The stack holds directories to walk,
+    # with their states, and matching files, without.
+    if not states:
+        return
+    stack = [(d, states)]
+    while stack:
+        d, states = stack.pop()
+        if states is None:
+            yield d
+            continue
+        entries = _glob_entries(glob, d, states, listdir)
+        stack.extend((path, substates)
+                     for _, path, substates in reversed(entries))
+
+
+def _glob_entries(glob, d, states, listdir):
+    # The matching files of d, and the directories within it which could
+    # contain matches with their states, as (key, path, states) tuples
+    # ordered by their paths. Directory keys are followed by the path
+    # separator, and files have no states.
+    entries = []
+    for name, is_dir, is_link in listdir(d):
+        path = os.path.join(d, name)
+        if not is_dir:
+            if glob.match(path):
+                entries.append((name, path, None))
+        elif not is_link:
+            substates = glob.descend(states, name)
+            if substates:
+                entries.append((name + os.sep, path, substates))
+    entries.sort()
+    return entries
+
+
+class _ParallelWalk(object):
+    # Walks directories in a pool of threads, each popping the deepest
+    # directory from its own deque or stealing the shallowest from another's,
+    # and passing the entries of each directory to the reader through a
+    # bounded queue. The threads are started once the reader asks for the
+    # first path, and stopped once it is done with the walk, so that a walk
+    # which is never read starts no threads.
+
+    def __init__(self, glob, listdir, workers, maxsize):
+        self.glob = glob
+        self.listdir = listdir
+        self.deques = [deque() for _ in range(workers)]
+        self.pending = 0
+        self.stopped = False
+        self.lock = threading.Condition()
+        self.listings = deque()
+        self.maxsize = maxsize
+        self.threads = [threading.Thread(target=self.work, args=(i,))
+                        for i in range(workers)]
+        for thread in self.threads:
+            thread.daemon = True
+
+    def start(self, d, states):
+        self.deques[0].append((d, states))
+        self.pending = 1
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self):
+        with self.lock:
+            self.stopped = True
+            self.lock.notify_all()
+
+    def take(self, i):
+        # The next directory for thread i to list, or None once there are no
+        # more.
+        n = len(self.deques)
+        with self.lock:
+            while not self.stopped and self.pending:
+                if self.deques[i]:
+                    return self.deques[i].pop()
+                for j in range(i + 1, i + n):
+                    if self.deques[j % n]:
+                        return self.deques[j % n].popleft()
+                self.lock.wait()
+        return None
+
+    def work(self, i):
+        try:
+            while True:
+                task = self.take(i)
+                if task is None:
+                    return
+                d, states = task
+                entries = _glob_entries(self.glob, d, states, self.listdir)
+                with self.lock:
+                    for _, path, substates in reversed(entries):
+                        if substates is not None:
+                            self.deques[i].append((path, substates))
+                            self.pending += 1
+                    self.lock.notify_all()
+                self.put((d, entries))
+                with self.lock:
+                    self.pending -= 1
+                    done = not self.pending
+                    if done:
+                        self.lock.notify_all()
+                if done:
+                    self.put(None)
+        except Exception as e:
+            self.put(e)
+            self.stop()
+
+    def put(self, item):
+        # Wait for the reader, giving up once the walk is stopped.
+        with self.lock:
+            while not self.stopped and \
+                    0 < self.maxsize <= len(self.listings):
+                self.lock.wait()
+            if not self.stopped:
+                self.listings.append(item)
+                self.lock.notify_all()
+
+    def get(self):
+        with self.lock:
+            while not self.listings:
+                self.lock.wait()
+            item = self.listings.popleft()
+            self.lock.notify_all()
+        if isinstance(item, Exception):
+            raise item
+        return item
+
+    def unordered(self, d, states):
+        try:
+            self.start(d, states)
+            while True:
+                item = self.get()
+                if item is None:
+                    return
+                for _, path, substates in item[1]:
+                    if substates is None:
+                        yield path
+        finally:
+            self.stop()
+
+    def ordered(self, d, states):
+        listings = {}
+        stack = [(d, True)]
+        try:
+            self.start(d, states)
+            while stack:
+                path, is_dir = stack.pop()
+                if not is_dir:
+                    yield path
+                    continue
+                while path not in listings:
+                    item = self.get()
+                    if item is not None:
+                        listings[item[0]] = item[1]
+                stack.extend((p, substates is not None)
+                             for _, p, substates in
+                             reversed(listings.pop(path)))
+        finally:
+            self.stop()
+
+
+class GlobPattern(object):
+    """GlobPattern matches relative file paths per fnmatch, and determines
+    which directories could contain matching files.
+
+    Directories are tracked with the states of a nondeterministic automaton
+    for the pattern, which are advanced by each directory name. Where no
+    states remain, no path within the directory can match.
+
+    :param pattern: The pattern to match relative file paths to.
+    :param sep: The path separator.
+
+    """
+
+    def __init__(self, pattern, sep=os.sep):
+        self.pattern = pattern
+        self.sep = sep
+        self.match = re.compile(fnmatch.translate(pattern)).match
+        self.tokens = _glob_tokens(pattern)
+
+        # The leading directories of the pattern which are matched literally.
+        # Listings never name "", "." or "..", so the prefix stops before
+        # them rather than following them out of the root.
+        self.prefix = []
+        for part in pattern.split(sep)[:-1]:
+            if _GLOB_MAGIC.search(part) or part in ("", os.curdir,
+                                                    os.pardir):
+                break
+            self.prefix.append(part)
+
+    def start(self, root, isdir=None):
+        """start returns the relative directory from which to search root and
+        its states, which are empty if it cannot be searched.
+
+        :param isdir: A callable returning whether a relative path is a
+                      directory to search, which is not a symbolic link.
+                      Defaults to checking the filesystem.
+
+        """
+        if isdir is None:
+            isdir = partial(_isdir_within, root)
+        states = self.closure([0])
+        d = ""
+        for part in self.prefix:
+            d = os.path.join(d, part)
+            if not isdir(d):
+                return d, frozenset()
+            states = self.descend(states, part)
+        return d, states
+
+    def descend(self, states, name):
+        """descend returns the states of the subdirectory name of a directory
+        with the given states."""
+        return self.advance(states, name + self.sep)
+
+    def advance(self, states, s):
+        """advance returns the states reached by consuming the string s."""
+        tokens, n = self.tokens, len(self.tokens)
+        for c in s:
+            if not states:
+                break
+            following = []
+            for k in states:
+                if k == n:
+                    continue
+                kind, value = tokens[k]
+                if kind == "*":
+                    following.append(k)
+                elif kind == "?" or (kind == "[" and value(c)) or value == c:
+                    following.append(k + 1)
+            states = self.closure(following)
+        return states
+
+    def closure(self, states):
+        """closure adds the states reached by skipping empty * wildcards."""
+        tokens, n = self.tokens, len(self.tokens)
+        closed = []
+        for k in states:
+            closed.append(k)
+            while k < n and tokens[k][0] == "*":
+                k += 1
+                closed.append(k)
+        return frozenset(closed)
+
+
+def _glob_tokens(pattern):
+    # Parse the pattern into (kind, value) tokens the way fnmatch.translate
+    # does: "*" and "?" wildcards, "[" character classes matching one
+    # character, and single literal characters.
+    tokens = []
+    i, n = 0, len(pattern)
+    while i < n:
+        c = pattern[i]
+        i += 1
+        if c == "*":
+            if not tokens or tokens[-1][0] != "*":
+                tokens.append(("*", None))
+        elif c == "?":
+            tokens.append(("?", None))
+        elif c == "[":
+            j = i
+            if j < n and pattern[j] == "!":
+                j += 1
+            if j < n and pattern[j] == "]":
+                j += 1
+            while j < n and pattern[j] != "]":
+                j += 1
+            if j >= n:
+                tokens.append(("c", c))
+            else:
+                stuff = pattern[i:j].replace("\\", "\\\\")
+                i = j + 1
+                if stuff[0] == "!":
+                    stuff = "^" + stuff[1:]
+                elif stuff[0] == "^":
+                    stuff = "\\" + stuff
+                tokens.append(("[", re.compile("[%s]" % stuff).match))
+        else:
+            tokens.append(("c", c))
+    return tokens
+
+
+def _isdir_within(root, d):
+    path = os.path.join(root, d)
+    return os.path.isdir(path) and not os.path.islink(path)
+
+
+def _listdir_within(root, d):
+    return _listdir(os.path.join(root, d))
+
+
+def _listdir(path):
+    # List the (name, is_dir, is_link) entries of a directory in name order,
+    # using scandir where available to avoid a stat per entry. Directories
+    # which cannot be listed are treated as empty, as by os.walk.
+    try:
+        if scandir is not None:
+            entries = [(e.name, e.is_dir(), e.is_symlink())
+                       for e in scandir(path)]
+        else:
+            entries = [
+                (name, os.path.isdir(os.path.join(path, name)),
+                 os.path.islink(os.path.join(path, name)))
+                for name in os.listdir(path)
+            ]
+    except OSError:
+        return []
+    entries.sort()
+    return entries
@@ -0,0 +1,185 @@
+import math
+import operator
+import threading
+import time
+
+
+class BudgetExceeded(Exception):
+    """BudgetExceeded is raised when an evaluation crosses a limit of its
+    Budget.
+
+    :param limit: The name of the limit crossed: "timeout", "size",
+                  "lookups", "magnitude" or "cancelled".
+
+    """
+
+    def __init__(self, limit, message):
+        Exception.__init__(self, message)
+        self.limit = limit
+
+
+class Budget(object):
+    """Budget limits the work of evaluations given it by evil, which are
+    checked before and after each lookup, operator and reduction, and abort
+    with BudgetExceeded as soon as a limit is crossed.
+
+    The results of lookups are counted as they are read, and factorials and
+    powers whose results would be too great are not calculated at all.
+
+    :param timeout: The number of seconds an evaluation may take.
+    :param max_size: The greatest number of values a lookup, operator or
+                     reduction may find.
+    :param max_lookups: The greatest number of lookups an evaluation may
+                        make.
+    :param max_magnitude: The greatest absolute value of the numbers an
+                          operator or reduction may find.
+    :param timer: A callable returning the current time in seconds.
+
+    """
+
+    def __init__(self, timeout=None, max_size=None, max_lookups=None,
+                 max_magnitude=None, timer=time.time):
+        self.timeout = timeout
+        self.max_size = max_size
+        self.max_lookups = max_lookups
+        self.max_magnitude = max_magnitude
+        self.timer = timer
+        self.cancelled = False
+
+    def cancel(self):
+        """cancel aborts the evaluations using the budget at their next
+        check, and any evaluations which begin with it afterwards."""
+        self.cancelled = True
+
+    def start(self):
+        """start returns the Allowance of an evaluation beginning now."""
+        return Allowance(self)
+
+
+class Allowance(object):
+    """Allowance tracks what remains of a Budget during one evaluation.
+
+    :param budget: The Budget to track.
+
+    """
+
+    # The number of values of a lookup read between checks of the deadline
+    interval = 1024
+
+    def __init__(self, budget):
+        self.budget = budget
+        self.deadline = None
+        if budget.timeout is not None:
+            self.deadline = budget.timer() + budget.timeout
+        self.lookups = 0
+        self._lock = threading.Lock()
+        self.check()
+
+    def check(self):
+        """check raises BudgetExceeded if the evaluation has been cancelled
+        or has run out of time."""
+        if self.budget.cancelled:
+            raise BudgetExceeded("cancelled", "The evaluation was cancelled.")
+        if self.deadline is not None and self.budget.timer() > self.deadline:
+            raise BudgetExceeded("timeout", "The evaluation took longer than "
+                                 "%s seconds." % self.budget.timeout)
+
+    def lookup(self, pattern):
+        """lookup counts a lookup of pattern, before it is made."""
+        self.check()
+        with self._lock:
+            self.lookups += 1
+            lookups = self.lookups
+        if self.budget.max_lookups is not None and \
+                lookups > self.budget.max_lookups:
+            raise BudgetExceeded("lookups", "The evaluation made more than %d "
+                                 "lookups." % self.budget.max_lookups)
+
+    def apply(self, func, args):
+        """apply checks the application of func to args, before it is made."""
+        self.check()
+        predict = _PREDICTIONS.get(func)
+        if predict is not None and self.budget.max_magnitude is not None:
+            try:
+                log = predict(*args)
+            except (TypeError, ValueError):
+                return
+            if log > math.log(self.budget.max_magnitude):
+                raise self._magnitude()
+
+    def limit(self, values):
+        """limit returns the values found by a lookup, counting them as they
+        are read."""
+        if self.budget.max_size is None and self.deadline is None or \
+                hasattr(values, "__len__") or \
+                not hasattr(values, "__iter__"):
+            return values
+        return self._limit(values)
+
+    def result(self, value):
+        """result checks the value found by a lookup, operator or reduction.
+        """
+        self.check()
+        max_size = self.budget.max_size
+        if max_size is not None and hasattr(value, "__len__") and \
+                len(value) > max_size:
+            raise self._size()
+        max_magnitude = self.budget.max_magnitude
+        if max_magnitude is not None and \
+                isinstance(value, (int, long, float)) and \
+                abs(value) > max_magnitude:
+            raise self._magnitude()
+        return value
+
+    def _limit(self, values):
+        max_size = self.budget.max_size
+        for n, value in enumerate(values, 1):
+            if max_size is not None and n > max_size:
+                raise self._size()
+            if not n % self.interval:
+                self.check()
+            yield value
+
+    def _size(self):
+        return BudgetExceeded("size", "More than %d values were found."
+                              % self.budget.max_size)
+
+    def _magnitude(self):
+        return BudgetExceeded("magnitude", "A number greater than %s was "
+                              "found." % self.budget.max_magnitude)
+
+
+def _factorial_log(n):
+    if n < 2:
+        return 0.0
+    return math.lgamma(n + 1)
+
+
+def _pow_log(a, b):
+    a = abs(a)
+    if a <= 1 or b <= 0:
+        return 0.0
+    return b * math.log(a)
+
+
+# The natural logarithms of the results of operators which are too costly to
+# find before checking their magnitude.
+_PREDICTIONS = {
+    math.factorial: _factorial_log,
+    operator.pow: _pow_log,
+}
+
+
+def _budgeted_lookup(allowance, lookup, cast, pattern):
+    allowance.lookup(pattern)
+    return allowance.result(cast(allowance.limit(lookup(pattern))))
+
+
+def _budgeted_apply(allowance, func, *args):
+    allowance.apply(func, args)
+    return allowance.result(func(*args))
+
+
+def _budgeted_reduce(allowance, reducer, values):
+    allowance.check()
+    return allowance.result(reducer(values))
@@ -0,0 +1,147 @@
+from collections import OrderedDict
+import threading
+import time
+
+
+class LRUCache(object):
+    """LRUCache is a thread-safe mapping which evicts the least recently used
+    entries beyond maxsize.
+
+    :param maxsize: The maximum number of entries to keep, or None to keep
+                    them all.
+
+    """
+
+    def __init__(self, maxsize=None):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __getstate__(self):
+        # Locks cannot be pickled, so that a cache is copied with its entries
+        # and given a lock of its own, as by a process pool.
+        with self._lock:
+            return self.maxsize, list(self._entries.items())
+
+    def __setstate__(self, state):
+        self.maxsize, entries = state
+        self._entries = OrderedDict(entries)
+        self._lock = threading.Lock()
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._entries.pop(key)
+            except KeyError:
+                return default
+            self._entries[key] = value
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = value
+            if self.maxsize is not None:
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            return self._entries.pop(key, default)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class CachedLookup(object):
+    """CachedLookup memoizes the results of a lookup.
+
+    Within a single evaluation each distinct pattern is looked up once.
+    Across evaluations results are kept for reuse until they are evicted or
+    the space they were found in changes.
+
+    :param lookup: The lookup whose results are cached.
+    :param maxsize: The maximum number of patterns to keep results for across
+                    evaluations. None keeps every result and 0 keeps none.
+    :param ttl: The number of seconds to keep results for, or None to keep
+                them until they are evicted.
+    :param version: A callable returning the version or fingerprint of the
+                    space searched by the lookup. All results are discarded
+                    when it changes.
+    :param timer: A callable returning the current time in seconds.
+
+    """
+
+    def __init__(self, lookup, maxsize=None, ttl=None, version=None,
+                 timer=time.time):
+        self.lookup = lookup
+        self.cache = LRUCache(maxsize)
+        self.ttl = ttl
+        self.version = version
+        self.timer = timer
+        self.hits = 0
+        self.misses = 0
+        self._version = None
+
+    def __call__(self, pattern):
+        if self.version is not None:
+            version = self.version()
+            if version != self._version:
+                self.cache.clear()
+                self._version = version
+
+        entry = self.cache.get(pattern)
+        if entry is not None:
+            expires, result = entry
+            if expires is None or expires > self.timer():
+                self.hits += 1
+                return result
+            self.cache.pop(pattern)
+
+        self.misses += 1
+        result = _materialize(self.lookup(pattern))
+        if self.cache.maxsize != 0:
+            expires = None if self.ttl is None else self.timer() + self.ttl
+            self.cache.set(pattern, (expires, result))
+        return result
+
+    def scope(self):
+        """scope returns a lookup for use during a single evaluation, which
+        looks up each distinct pattern at most once."""
+        results = {}
+
+        def lookup(pattern):
+            try:
+                result = results[pattern]
+            except KeyError:
+                result = results[pattern] = self(pattern)
+            else:
+                self.hits += 1
+            return result
+
+        return lookup
+
+    def invalidate(self, pattern=None):
+        """invalidate discards the cached results of the given pattern, or of
+        all patterns."""
+        if pattern is None:
+            self.cache.clear()
+        else:
+            self.cache.pop(pattern)
+
+
+def _materialize(result):
+    # Iterators such as those from globlookup can only be read once.
+    try:
+        if iter(result) is result:
+            return list(result)
+    except TypeError:
+        pass
+    return result
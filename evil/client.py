@@ -0,0 +1,91 @@
+"""A thin client of evil.server, which sends it an expression and prints the
+values of the result as they arrive, one per line.
+
+  $ python -m evil.client -s /tmp/evil.sock "*.py - test*"
+  $ python -m evil.client -s /tmp/evil.sock --maths "(2 + 2)!"
+
+"""
+import argparse
+import json
+import os
+import socket
+import sys
+
+
+class RemoteError(Exception):
+    """RemoteError is raised when the server cannot evaluate a request.
+
+    :param type: The name of the type of the error raised by the server.
+
+    """
+
+    def __init__(self, message, type):
+        Exception.__init__(self, message)
+        self.type = type
+
+
+def request(path, expr, evaluator="set", root=None, budget=None):
+    """request asks the server listening on path to evaluate an expression,
+    and yields the values of its result as they are received.
+
+    :param path: The path of the server's socket.
+    :param expr: The expression to evaluate.
+    :param evaluator: "set" or "maths", per evil.server.
+    :param root: The directory to find paths within. Defaults to the current
+                 working directory.
+    :param budget: A dict of the limits of the evaluation, per evil.server.
+    :raises: RemoteError
+
+    """
+    if root is None:
+        root = os.getcwd()
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+        message = {"expr": expr, "evaluator": evaluator, "root": root}
+        if budget is not None:
+            message["budget"] = budget
+        sock.sendall(json.dumps(message) + "\n")
+        sock.shutdown(socket.SHUT_WR)
+        for line in iter(sock.makefile("rb").readline, ""):
+            response = json.loads(line)
+            if "result" in response:
+                yield response["result"]
+            elif "error" in response:
+                raise RemoteError(response["error"], response["type"])
+            else:
+                return
+    finally:
+        sock.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="evil.client", description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("expr", nargs="+", help="the expression")
+    parser.add_argument("-s", "--socket", required=True,
+                        help="the path of the server's socket")
+    parser.add_argument("--maths", action="store_const", const="maths",
+                        default="set", dest="evaluator",
+                        help="evaluate a maths expression")
+    parser.add_argument("--root", help="the directory to find paths within")
+    parser.add_argument("--timeout", type=float,
+                        help="the number of seconds the evaluation may take")
+    args = parser.parse_args(argv)
+
+    budget = None
+    if args.timeout is not None:
+        budget = {"timeout": args.timeout}
+    try:
+        for value in request(args.socket, " ".join(args.expr),
+                             args.evaluator, args.root, budget):
+            print value
+    except RemoteError as e:
+        print >>sys.stderr, "%s: %s" % (e.type, e)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
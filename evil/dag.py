@@ -0,0 +1,250 @@
+from collections import deque, OrderedDict
+from functools import partial
+
+from evil import op
+from evil.cache import LRUCache
+from evil.index import StrIndex
+from evil.set import set_evil, set_operators
+
+
+class CycleError(ValueError):
+    """CycleError is raised when a dependency would make a DAG cyclic.
+
+    :param nodes: The nodes on or depending on the cycle.
+
+    """
+
+    def __init__(self, message, nodes=()):
+        ValueError.__init__(self, message)
+        self.nodes = nodes
+
+
+class DAG(object):
+    """DAG is a directed acyclic graph of named nodes, each depending on
+    others, which can be given as the lookup of set_evil.
+
+    The dependencies and dependents of a node are found by walking each
+    node they contain once, taking the closures kept from earlier queries of
+    the nodes reached rather than walking beyond them. Closures are kept
+    until an update changes them.
+
+    Like a Space, a DAG tells its subscribers of the nodes added to and
+    removed from it, so that it can be given to a MaterializedSet.
+
+    :param graph: A mapping of each node to the nodes it depends on. Nodes
+                  only named as dependencies are added too.
+    :param cache_size: The number of closures of each kind to keep.
+    :raises: CycleError
+
+    """
+
+    def __init__(self, graph=(), cache_size=1024):
+        self._up = OrderedDict()    # The nodes each node depends on
+        self._down = OrderedDict()  # The nodes depending on each node
+        self._ups = LRUCache(maxsize=cache_size)    # Closures of _up
+        self._downs = LRUCache(maxsize=cache_size)  # Closures of _down
+        self._order = None
+        self._subscribers = []
+        self.index = StrIndex()
+
+        graph = dict(graph)
+        for node, dependencies in graph.items():
+            self._add_node(node)
+            for dependency in dependencies:
+                self._add_node(dependency)
+                self._up[node].add(dependency)
+                self._down[dependency].add(node)
+        self.order()
+
+    def __call__(self, pattern):
+        return self.index(pattern)
+
+    def __contains__(self, node):
+        return node in self._up
+
+    def __iter__(self):
+        return iter(self._up)
+
+    def __len__(self):
+        return len(self._up)
+
+    def __getstate__(self):
+        # A copy, as made by a process pool, has no subscribers of its own.
+        state = self.__dict__.copy()
+        state["_subscribers"] = []
+        return state
+
+    def subscribe(self, callback):
+        """subscribe calls callback(added, removed) with the lists of nodes
+        added and removed by each change to the DAG."""
+        self._subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        self._subscribers.remove(callback)
+
+    def order(self):
+        """order returns the nodes in topological order, each after all of
+        its dependencies.
+
+        :raises: CycleError
+
+        """
+        if self._order is None:
+            waiting = dict((node, len(up)) for node, up in self._up.items())
+            ready = deque(node for node, n in waiting.items() if not n)
+            order = []
+            while ready:
+                node = ready.popleft()
+                order.append(node)
+                for dependent in self._down[node]:
+                    waiting[dependent] -= 1
+                    if not waiting[dependent]:
+                        ready.append(dependent)
+            if len(order) < len(waiting):
+                cyclic = [node for node, n in waiting.items() if n]
+                raise CycleError("The graph has a cycle.", cyclic)
+            self._order = order
+        return list(self._order)
+
+    def dependencies(self, nodes):
+        """dependencies returns the given nodes and every node they depend on,
+        directly or indirectly."""
+        return self._closures(nodes, self._up, self._ups)
+
+    def dependents(self, nodes):
+        """dependents returns the given nodes and every node depending on
+        them, directly or indirectly."""
+        return self._closures(nodes, self._down, self._downs)
+
+    def add(self, node, dependencies=()):
+        """add adds node, if it is not present, and its dependencies.
+
+        :raises: CycleError
+
+        """
+        self._add_node(node)
+        for dependency in dependencies:
+            self.add_edge(node, dependency)
+
+    def remove(self, node):
+        """remove removes node and the dependencies upon and of it."""
+        for dependent in list(self._down[node]):
+            self.remove_edge(dependent, node)
+        for dependency in list(self._up[node]):
+            self.remove_edge(node, dependency)
+        del self._up[node]
+        del self._down[node]
+        self._ups.pop(node, None)
+        self._downs.pop(node, None)
+        self.index.discard(node)
+        self._order = None
+        self._changed([], [node])
+
+    def add_edge(self, node, dependency):
+        """add_edge makes node depend on dependency, adding either if they are
+        not present.
+
+        :raises: CycleError
+
+        """
+        self._add_node(node)
+        self._add_node(dependency)
+        if dependency in self._up[node]:
+            return
+        if node in self.dependencies([dependency]):
+            raise CycleError("%r cannot depend on %r, which depends on it."
+                             % (node, dependency), [node, dependency])
+        self._invalidate(node, dependency)
+        self._up[node].add(dependency)
+        self._down[dependency].add(node)
+
+    def remove_edge(self, node, dependency):
+        """remove_edge removes the dependency of node on dependency, if there
+        is one."""
+        if dependency not in self._up.get(node, ()):
+            return
+        self._invalidate(node, dependency)
+        self._up[node].remove(dependency)
+        self._down[dependency].remove(node)
+
+    def _add_node(self, node):
+        if node not in self._up:
+            self._up[node] = set()
+            self._down[node] = set()
+            self.index.add(node)
+            self._order = None
+            self._changed([node], [])
+
+    def _changed(self, added, removed):
+        for callback in list(self._subscribers):
+            callback(added, removed)
+
+    def _invalidate(self, node, dependency):
+        # An edge from node to dependency changes the dependencies of node
+        # and its dependents, and the dependents of dependency and its
+        # dependencies, but neither of the closures used to find them.
+        for n in self.dependents([node]):
+            self._ups.pop(n, None)
+        for n in self.dependencies([dependency]):
+            self._downs.pop(n, None)
+        self._order = None
+
+    def _closures(self, nodes, edges, memo):
+        # Walk the nodes reachable from nodes, adding the kept closures of
+        # those reached rather than walking beyond them, so that each node
+        # of the result is visited once.
+        nodes = list(nodes)
+        found = set(nodes)
+        stack = list(found)
+        while stack:
+            node = stack.pop()
+            closure = memo.get(node)
+            if closure is not None:
+                found.update(closure)
+                continue
+            for edge in edges[node]:
+                if edge not in found:
+                    found.add(edge)
+                    stack.append(edge)
+        if len(nodes) == 1:
+            memo.set(nodes[0], frozenset(found))
+        return found
+
+
+# The tokens of dag_operators which are not set_operators
+DAG_PURE = ("^", "~")
+
+
+def dag_operators(dag):
+    """dag_operators returns set_operators with the ^ operator, giving the
+    dependencies of the nodes to its right, and the ~ operator, giving their
+    dependents, each including the nodes themselves. The operators can be
+    pickled, with a copy of dag, as a process pool requires."""
+    return [
+        op("^", partial(_dependencies, dag), right=True),
+        op("~", partial(_dependents, dag), right=True),
+    ] + set_operators()
+
+
+def _dependencies(dag, nodes):
+    return dag.dependencies(nodes)
+
+
+def _dependents(dag, nodes):
+    return dag.dependents(nodes)
+
+
+def dag_evil(expr, dag, operators=None, tokenizer=None, executor=None,
+             pure=None, budget=None):
+    """dag_evil evaluates an expression of the nodes of dag as set_evil does,
+    with the dag_operators.
+
+    :param dag: The DAG whose nodes are matched by the patterns of expr.
+    :param pure: As given to set_evil. DAG_PURE + SET_PURE are the tokens of
+                 dag_operators.
+
+    """
+    if operators is None:
+        operators = dag_operators(dag)
+    return set_evil(expr, dag, operators=operators, tokenizer=tokenizer,
+                    executor=executor, pure=pure, budget=budget)
@@ -0,0 +1,285 @@
+from bisect import bisect_left, insort
+import fnmatch
+import os
+import re
+import sqlite3
+import time
+
+from evil import _GLOB_MAGIC, GlobPattern, _listdir, _walk_glob
+from evil.cache import LRUCache
+
+
+class StrIndex(object):
+    """StrIndex finds names in a space matching a pattern, as strlookup, and
+    can be given as the lookup in its place.
+
+    Names are kept in a sorted list so that patterns beginning with literal
+    characters only examine the names sharing that prefix, and names without
+    wildcards are found directly. Results are in name order.
+
+    :param space: The names to index.
+    :param cache_size: The number of compiled patterns to keep.
+
+    """
+
+    def __init__(self, space=(), cache_size=256):
+        self.names = sorted(set(space))
+        self._members = set(self.names)
+        self._regexes = LRUCache(maxsize=cache_size)
+
+    def __call__(self, pattern):
+        magic = _GLOB_MAGIC.search(pattern)
+        if magic is None:
+            return [pattern] if pattern in self._members else []
+
+        match = self._match(pattern)
+        lo, hi = self._prefix_range(pattern[:magic.start()])
+        return [name for name in self.names[lo:hi] if match(name)]
+
+    def __contains__(self, name):
+        return name in self._members
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __len__(self):
+        return len(self.names)
+
+    def prefixed(self, prefix):
+        """prefixed returns the names beginning with prefix, in order."""
+        lo, hi = self._prefix_range(prefix)
+        return self.names[lo:hi]
+
+    def estimate(self, pattern):
+        """estimate returns an upper bound of the number of names matching
+        pattern, found without matching any names."""
+        magic = _GLOB_MAGIC.search(pattern)
+        if magic is None:
+            return int(pattern in self._members)
+        lo, hi = self._prefix_range(pattern[:magic.start()])
+        return hi - lo
+
+    def within(self, pattern, candidates):
+        """within returns the names of candidates matching pattern, examining
+        whichever of the candidates or the indexed names is fewer.
+
+        :param pattern: The pattern to match names by.
+        :param candidates: A collection of names, outside of which the result
+                           of the lookup is not needed.
+
+        """
+        if len(candidates) >= self.estimate(pattern):
+            return self(pattern)
+        match = self._match(pattern)
+        return [name for name in candidates
+                if name in self._members and match(name)]
+
+    def add(self, name):
+        """add adds name to the space, if it is not already present."""
+        if name not in self._members:
+            self._members.add(name)
+            insort(self.names, name)
+
+    def discard(self, name):
+        """discard removes name from the space, if it is present."""
+        if name in self._members:
+            self._members.remove(name)
+            del self.names[bisect_left(self.names, name)]
+
+    def update(self, names):
+        """update adds each of names to the space."""
+        for name in names:
+            self.add(name)
+
+    def _match(self, pattern):
+        match = self._regexes.get(pattern)
+        if match is None:
+            match = re.compile(fnmatch.translate(pattern)).match
+            self._regexes.set(pattern, match)
+        return match
+
+    def _prefix_range(self, prefix):
+        # The slice of names beginning with prefix
+        if not prefix:
+            return 0, len(self.names)
+        lo = bisect_left(self.names, prefix)
+        successor = _successor(prefix)
+        if successor is None:
+            return lo, len(self.names)
+        return lo, bisect_left(self.names, successor, lo)
+
+
+class PathIndex(object):
+    """PathIndex keeps the directory tree beneath root in an SQLite database,
+    and finds paths matching a pattern from it, as globlookup does, without
+    walking the tree. It can be given as the lookup in place of globlookup.
+
+    Opening an index built by an earlier run rescans only the directories
+    whose modification time has changed since they were last scanned.
+
+    :param root: The root directory to search within.
+    :param path: The file to keep the index in. Defaults to memory, in which
+                 case the tree is scanned in full.
+    :param refresh: Whether to bring the index up to date when it is opened.
+
+    The index may be used from any thread, but from only one at a time.
+
+    """
+
+    # Directories modified this many seconds before being scanned are
+    # rescanned on the next refresh, in case they change again within the
+    # resolution of their modification time.
+    racy = 2.0
+
+    def __init__(self, root, path=":memory:", refresh=True):
+        self.root = os.path.abspath(root)
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.text_factory = str
+        with self.db:
+            self.db.executescript(_PATH_INDEX_SCHEMA)
+            indexed = self.db.execute("SELECT value FROM meta "
+                                      "WHERE key = 'root'").fetchone()
+            if indexed is None or indexed[0] != self.root:
+                self.db.execute("DELETE FROM dirs")
+                self.db.execute("DELETE FROM entries")
+                self.db.execute("INSERT OR REPLACE INTO meta VALUES "
+                                "('root', ?)", (self.root,))
+                refresh = True
+        if refresh:
+            self.refresh()
+
+    def __call__(self, pattern):
+        glob = GlobPattern(pattern)
+        d, states = glob.start(self.root, self._isdir)
+        return _walk_glob(glob, d, states, self.listdir)
+
+    def listdir(self, d):
+        """listdir returns the (name, is_dir, is_link) entries of the relative
+        directory d in name order, as they were last scanned."""
+        return [
+            (name, bool(is_dir), False)
+            for name, is_dir in self.db.execute(
+                "SELECT name, is_dir FROM entries WHERE dir = ? "
+                "ORDER BY name", (d,))
+        ]
+
+    def refresh(self):
+        """refresh rescans the directories whose modification time has
+        changed, and any new directories within them.
+
+        :returns: the number of directories scanned.
+
+        """
+        with self.db:
+            dirs = self.db.execute("SELECT path, mtime FROM dirs").fetchall()
+            if not dirs:
+                return self._scan("")
+            changed = [
+                d for d, mtime in dirs
+                if mtime is None or _mtime(self._path(d)) != mtime
+            ]
+            scanned = 0
+            for d in sorted(changed):
+                if self._isdir(d):
+                    scanned += self._scan(d)
+            return scanned
+
+    def close(self):
+        self.db.close()
+
+    def _path(self, d):
+        return os.path.join(self.root, d)
+
+    def _isdir(self, d):
+        return self.db.execute("SELECT 1 FROM dirs WHERE path = ?",
+                               (d,)).fetchone() is not None
+
+    def _scan(self, d):
+        # Bring the entries of d up to date, removing the directories which
+        # are gone and scanning those which are new.
+        scanned = 0
+        stack = [d]
+        while stack:
+            d = stack.pop()
+            path = self._path(d)
+            mtime = _mtime(path)
+            if mtime is None:
+                self._remove(d)
+                continue
+
+            # Symbolic links to directories are neither matched nor searched
+            before = dict((name, is_dir)
+                          for name, is_dir, _ in self.listdir(d))
+            after = dict((name, is_dir)
+                         for name, is_dir, is_link in _listdir(path)
+                         if not (is_dir and is_link))
+            for name, is_dir in before.items():
+                if after.get(name) != is_dir and is_dir:
+                    self._remove(os.path.join(d, name))
+            for name, is_dir in after.items():
+                if before.get(name) != is_dir and is_dir:
+                    stack.append(os.path.join(d, name))
+
+            self.db.execute("DELETE FROM entries WHERE dir = ?", (d,))
+            self.db.executemany("INSERT INTO entries VALUES (?, ?, ?)",
+                                [(d, name, is_dir)
+                                 for name, is_dir in after.items()])
+            if time.time() - mtime < self.racy:
+                mtime = None
+            self.db.execute("INSERT OR REPLACE INTO dirs VALUES (?, ?)",
+                            (d, mtime))
+            scanned += 1
+        return scanned
+
+    def _remove(self, d):
+        # Remove d and all directories within it from the index.
+        if not d:
+            self.db.execute("DELETE FROM dirs")
+            self.db.execute("DELETE FROM entries")
+            return
+        lo = os.path.join(d, "")
+        hi = _successor(lo)
+        for table, column in [("dirs", "path"), ("entries", "dir")]:
+            self.db.execute("DELETE FROM %s WHERE %s = ? OR (%s >= ? AND "
+                            "%s < ?)" % (table, column, column, column),
+                            (d, lo, hi))
+        parent, name = os.path.split(d)
+        self.db.execute("DELETE FROM entries WHERE dir = ? AND name = ?",
+                        (parent, name))
+
+
+_PATH_INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS dirs (path TEXT PRIMARY KEY, mtime REAL);
+CREATE TABLE IF NOT EXISTS entries (
+    dir TEXT,
+    name TEXT,
+    is_dir INTEGER,
+    PRIMARY KEY (dir, name)
+);
+"""
+
+
+def _mtime(path):
+    # The modification time of a directory which is not a symbolic link, or
+    # None if there is no such directory.
+    try:
+        if os.path.islink(path) or not os.path.isdir(path):
+            return None
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+
+def _successor(prefix):
+    # The least string greater than every string beginning with prefix, or
+    # None if there is no such string.
+    while prefix:
+        last = ord(prefix[-1]) + 1
+        try:
+            if isinstance(prefix, unicode):
+                return prefix[:-1] + unichr(last)
+            return prefix[:-1] + chr(last)
+        except ValueError:
+            prefix = prefix[:-1]
+    return None
@@ -0,0 +1,159 @@
+import fnmatch
+import re
+
+from evil import NODE_APPLY, NODE_LOOKUP, Plan
+from evil.index import StrIndex
+from evil.set import set_compile, set_method
+
+
+class Space(object):
+    """Space is a set of names, which can be given as the lookup of set_evil
+    in place of strlookup, and which tells its subscribers of the names added
+    to and removed from it.
+
+    :param names: The names initially in the space.
+
+    """
+
+    def __init__(self, names=()):
+        self.index = StrIndex(names)
+        self._subscribers = []
+
+    def __call__(self, pattern):
+        return self.index(pattern)
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def __len__(self):
+        return len(self.index)
+
+    def subscribe(self, callback):
+        """subscribe calls callback(added, removed) with the lists of names
+        added and removed by each change to the space."""
+        self._subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        self._subscribers.remove(callback)
+
+    def add(self, name):
+        self.update(added=[name])
+
+    def discard(self, name):
+        self.update(removed=[name])
+
+    def update(self, added=(), removed=()):
+        """update adds names to the space and then removes names from it, as
+        one change."""
+        before = dict((name, name in self.index)
+                      for name in list(added) + list(removed))
+        for name in added:
+            self.index.add(name)
+        for name in removed:
+            self.index.discard(name)
+        added = [name for name, present in before.items()
+                 if not present and name in self.index]
+        removed = [name for name, present in before.items()
+                   if present and name not in self.index]
+        if added or removed:
+            for callback in list(self._subscribers):
+                callback(added, removed)
+
+
+class MaterializedSet(object):
+    """MaterializedSet keeps the result of an expression of the names in a
+    Space up to date as names are added to and removed from it.
+
+    The operators of the expression must be set.intersection, set.union and
+    set.difference, or their equivalents per set_method, which decide whether
+    a name is in their result from whether it is in their operands alone. So
+    each change is applied by deciding whether each name added or removed is
+    in the result, without evaluating the expression again.
+
+    :param expr: An expression, or a Plan compiled with set operators.
+    :param space: The Space or evil.dag.DAG whose names are matched by the
+                  patterns.
+    :param operators: As given to set_evil.
+    :raises: SyntaxError, ValueError
+
+    """
+
+    def __init__(self, expr, space, operators=None, tokenizer=None):
+        if not isinstance(expr, Plan):
+            expr = set_compile(expr, operators, tokenizer)
+        self.plan = expr
+        self.space = space
+        self.contains = _membership(expr)
+        self.result = set(name for name in space if self.contains(name))
+        self._subscribers = []
+        space.subscribe(self._changed)
+
+    def __contains__(self, name):
+        return name in self.result
+
+    def __iter__(self):
+        return iter(self.result)
+
+    def __len__(self):
+        return len(self.result)
+
+    def subscribe(self, callback):
+        """subscribe calls callback(added, removed) with the lists of names
+        added to and removed from the result by each change to the space."""
+        self._subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        self._subscribers.remove(callback)
+
+    def close(self):
+        """close stops the result being updated."""
+        self.space.unsubscribe(self._changed)
+
+    def _changed(self, added, removed):
+        added = [name for name in added if self.contains(name)]
+        removed = [name for name in removed if name in self.result]
+        self.result.update(added)
+        self.result.difference_update(removed)
+        if added or removed:
+            for callback in list(self._subscribers):
+                callback(added, removed)
+
+
+def _membership(plan):
+    # Build a predicate deciding whether a name in the space is in the result
+    # of the plan, evaluating only as many operands as needed.
+    predicates = []
+    for node in plan.nodes:
+        args = [predicates[a] for a in node.args]
+        method = set_method(node.func)
+        if node.kind == NODE_LOOKUP:
+            predicate = re.compile(fnmatch.translate(node.token)).match
+        elif node.kind == NODE_APPLY and method is set.intersection:
+            predicate = _all(args)
+        elif node.kind == NODE_APPLY and method is set.difference:
+            predicate = _difference(args)
+        elif node.kind == NODE_APPLY and method is not set.union:
+            raise ValueError("%s is not set.intersection, set.union or "
+                             "set.difference" % node.token)
+        elif len(args) == 1:
+            predicate = args[0]
+        else:
+            predicate = _any(args)
+        predicates.append(predicate)
+    return lambda name: bool(predicates[-1](name))
+
+
+def _all(predicates):
+    return lambda name: all(p(name) for p in predicates)
+
+
+def _any(predicates):
+    return lambda name: any(p(name) for p in predicates)
+
+
+def _difference(predicates):
+    first, rest = predicates[0], predicates[1:]
+    return lambda name: first(name) and not any(p(name) for p in rest)
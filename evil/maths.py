@@ -1,12 +1,25 @@
+import __builtin__
+import __future__
+import keyword
 import math
 import operator
+import re
 
 from evil import (
     evil,
+    evil_async,
+    compile,
     op,
     expr_tokenizer,
+    Plan,
+    NODE_LOOKUP, NODE_APPLY,
 )
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 
 def num(n):
     try:
@@ -16,7 +29,7 @@ def num(n):
 
 
 def maths_evil(expr, lookup=None, operators=None, cast=None, reducer=None,
-               tokenizer=None):
+               tokenizer=None, executor=None, tracer=None, budget=None):
     if lookup is None:
         lookup = num
     if operators is None:
@@ -28,7 +41,199 @@ def maths_evil(expr, lookup=None, operators=None, cast=None, reducer=None,
     if tokenizer is None:
         tokenizer = expr_tokenizer
     return evil(expr=expr, lookup=lookup, operators=operators, cast=cast,
-                reducer=reducer, tokenizer=tokenizer)
+                reducer=reducer, tokenizer=tokenizer, executor=executor,
+                tracer=tracer, budget=budget)
+
+
+def maths_evil_async(expr, lookup=None, operators=None, cast=None,
+                     reducer=None, tokenizer=None, limit=None, loop=None):
+    """maths_evil_async evaluates an expression as maths_evil does, making its
+    lookups concurrently per evil_async.
+    """
+    if lookup is None:
+        lookup = num
+    if operators is None:
+        operators = maths_operators()
+    if cast is None:
+        cast = num
+    if reducer is None:
+        reducer = sum
+    if tokenizer is None:
+        tokenizer = expr_tokenizer
+    return evil_async(expr=expr, lookup=lookup, operators=operators,
+                      cast=cast, reducer=reducer, tokenizer=tokenizer,
+                      limit=limit, loop=loop)
+
+
+def maths_compile(expr, operators=None, tokenizer=None):
+    """maths_compile compiles an expression for repeated evaluation by
+    maths_evil.
+    """
+    if operators is None:
+        operators = maths_operators()
+    if tokenizer is None:
+        tokenizer = expr_tokenizer
+    return compile(expr=expr, operators=operators, tokenizer=tokenizer)
+
+
+def maths_function(expr, variables=None, operators=None, tokenizer=None):
+    """maths_function compiles an expression into a Python function of its
+    variables, which returns what maths_evil would with the variables looked
+    up by name and other tokens as numbers.
+
+    The function is generated as Python source, with the default operators
+    written inline. Subexpressions of numbers alone are evaluated once, while
+    compiling, so operators must return the same result for the same
+    arguments. Variables are used as given rather than cast by num, and
+    operators are applied in the order Python evaluates the source, so of
+    several errors a different one may be raised than by maths_evil.
+
+    :param expr: An expression to compile, or a Plan compiled with the same
+                 operators.
+    :param variables: The names of the variables, in the order of the
+                      parameters of the function. Defaults to the tokens
+                      which are not numbers, in the order they appear.
+                      Names which are not identifiers or begin with an
+                      underscore can only be given by position.
+    :param operators: As given to maths_evil.
+    :returns: a function, with the names of its parameters in its variables
+              attribute and its source in its source attribute.
+
+    """
+    if operators is None:
+        operators = maths_operators()
+    plan = expr
+    if not isinstance(plan, Plan):
+        plan = maths_compile(expr, operators=operators, tokenizer=tokenizer)
+
+    tokens = [node.token for node in plan.nodes if node.kind == NODE_LOOKUP]
+    if variables is None:
+        variables = []
+        for token in tokens:
+            if token not in variables and _number(token) is None:
+                variables.append(token)
+    variables = list(variables)
+    params = dict(
+        (name, name if _IDENTIFIER.match(name) and not keyword.iskeyword(name)
+         and name not in _CONSTANTS else "_v%d" % i)
+        for i, name in enumerate(variables)
+    )
+
+    namespace = {"_factorial": math.factorial}
+
+    def name(value, prefix):
+        key = "%s%d" % (prefix, len(namespace))
+        namespace[key] = value
+        return key
+
+    # The source of each node, its value if it is constant, and whether it is
+    # a number rather than a bool or any other type.
+    sources, values, numbers = [], [], []
+    for node in plan.nodes:
+        value = _NOT_CONSTANT
+        number = True
+        if node.kind == NODE_LOOKUP:
+            if node.token in params:
+                source = params[node.token]
+            else:
+                # maths_evil looks numbers up with num and casts them with num
+                # again, which truncates 1.5 to 1.
+                value = num(num(node.token))
+                source = _literal(value) or name(value, "_c")
+        else:
+            args = [sources[a] for a in node.args]
+            constant = all(values[a] is not _NOT_CONSTANT for a in node.args)
+            if node.kind == NODE_APPLY:
+                func = node.func
+                inline = _INLINE.get(func)
+                if inline is not None:
+                    source = inline % tuple(args)
+                    number = func not in _COMPARISONS
+                else:
+                    source = "%s(%s)" % (name(func, "_f"), ", ".join(args))
+                    number = False
+            else:
+                # sum is 0 + each value, which only differs from adding the
+                # values themselves when summing a single bool.
+                func = _sum
+                if len(args) == 1 and numbers[node.args[0]]:
+                    source = args[0]
+                elif len(args) == 1:
+                    source = "(0 + %s)" % args[0]
+                else:
+                    source = "(%s)" % " + ".join(args)
+            if constant:
+                try:
+                    value = func(*[values[a] for a in node.args])
+                except Exception:
+                    # Leave errors to be raised when the function is called
+                    pass
+                else:
+                    source = _literal(value) or name(value, "_c")
+                    number = type(value) is not bool
+        sources.append(source)
+        values.append(value)
+        numbers.append(number)
+
+    source = "def maths_function(%s):\n    return %s\n" % (
+        ", ".join(params[v] for v in variables), sources[-1])
+    code = __builtin__.compile(source, "<maths_function>", "exec",
+                               __future__.division.compiler_flag, True)
+    exec(code, namespace)
+    func = namespace["maths_function"]
+    func.variables = tuple(variables)
+    func.source = source
+    return func
+
+
+# Python expressions for the operators of maths_operators.
+_INLINE = {
+    math.factorial: "_factorial(%s)",
+    operator.pow: "(%s ** %s)",
+    operator.mul: "(%s * %s)",
+    operator.truediv: "(%s / %s)",
+    operator.add: "(%s + %s)",
+    operator.sub: "(%s - %s)",
+    operator.eq: "(%s == %s)",
+    operator.ne: "(%s != %s)",
+    operator.gt: "(%s > %s)",
+    operator.lt: "(%s < %s)",
+    operator.ge: "(%s >= %s)",
+    operator.le: "(%s <= %s)",
+}
+
+_COMPARISONS = frozenset([
+    operator.eq, operator.ne, operator.gt, operator.lt, operator.ge,
+    operator.le,
+])
+
+_IDENTIFIER = re.compile(r"^[A-Za-z][A-Za-z0-9_]*$")
+
+# Names which are not keywords in Python 2 but cannot be parameters
+_CONSTANTS = ("None", "True", "False")
+
+_NOT_CONSTANT = object()
+
+
+def _sum(*values):
+    return sum(values)
+
+
+def _number(token):
+    try:
+        return num(token)
+    except ValueError:
+        return None
+
+
+def _literal(value):
+    # The Python literal of a number, or None if it has none.
+    if type(value) in (int, long) or (type(value) is float and
+                                      not math.isinf(value) and
+                                      not math.isnan(value)):
+        source = repr(value)
+        return "(%s)" % source if value < 0 else source
+    return None
 
 
 def maths_operators():
@@ -51,6 +256,75 @@ def maths_operators():
         op(",", operator.add),
     ]
 
+
+def maths_batch_evil(expr, columns, operators=None, tokenizer=None):
+    """maths_batch_evil evaluates an expression once over whole columns of
+    values, as maths_evil would for each row. It requires NumPy.
+
+    :param expr: An expression to evaluate, or a Plan compiled with the same
+                 operators.
+    :param columns: A mapping of names to equal-length sequences of values.
+                    Other tokens are treated as numbers.
+    :param operators: Operators acting element-wise on arrays. Defaults to
+                      maths_batch_operators.
+    :returns: a NumPy array with the value of the expression for each row.
+              Powers are floats, as integer arrays would overflow or reject
+              negative exponents where Python's integers do not.
+
+    """
+    if numpy is None:
+        raise ImportError("maths_batch_evil requires numpy")
+    if operators is None:
+        operators = maths_batch_operators()
+
+    def lookup(token):
+        try:
+            return columns[token]
+        except KeyError:
+            return num(token)
+
+    result = maths_evil(expr=expr, lookup=lookup, operators=operators,
+                        cast=numpy.asarray, tokenizer=tokenizer)
+    # An expression of no columns gives one value, which holds for each row.
+    result = numpy.asarray(result)
+    lengths = [len(column) for column in columns.values()]
+    if result.ndim == 0 and lengths:
+        result = numpy.repeat(result, lengths[0])
+    return result
+
+
+def maths_batch_operators():
+    return [
+        # Numeric operators
+        op("!", batch_factorial, left=True),
+        op("^", numpy.float_power),
+        op("*", numpy.multiply),
+        op("/", numpy.true_divide),
+        op("+", numpy.add),
+        op("-", numpy.subtract),
+        # Boolean logic operators
+        op("==", numpy.equal),
+        op("<>", numpy.not_equal),
+        op(">", numpy.greater),
+        op("<", numpy.less),
+        op(">=", numpy.greater_equal),
+        op("<=", numpy.less_equal),
+        # Separator
+        op(",", numpy.add),
+    ]
+
+
+def batch_factorial(n):
+    """batch_factorial returns the factorials of an array of integral values
+    as floats, gamma(n + 1), which are infinite beyond 170!.
+    """
+    n = numpy.asarray(n)
+    if (n < 0).any() or (n != numpy.floor(n)).any():
+        raise ValueError("factorial() only accepts integral values")
+    factorials = numpy.cumprod(numpy.arange(172, dtype=float).clip(1))
+    factorials[171] = numpy.inf
+    return factorials[numpy.minimum(n, 171).astype(int)]
+
 if __name__ == "__main__":
     import sys
     print maths_evil(" ".join(sys.argv[1:]))
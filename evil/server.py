@@ -0,0 +1,199 @@
+"""A daemon evaluating expressions sent to it over a Unix socket, keeping its
+lookup indexes, compiled expressions and results warm between requests.
+
+  $ python -m evil.server /tmp/evil.sock &
+  $ python -m evil.client -s /tmp/evil.sock "*.py - test*"
+
+Requests and responses are lines of JSON. A request is an object with:
+
+  expr: The expression to evaluate.
+  evaluator: "set", to evaluate it per set_evil, or "maths", per maths_evil.
+             Defaults to "set".
+  root: The directory whose paths are found by the patterns of set
+        expressions, per globlookup.
+  budget: An object of the limits of the evaluation, any of "timeout",
+          "max_size", "max_lookups" and "max_magnitude", per Budget.
+          Optional.
+
+Each value of the result is sent as {"result": value}, in order and as soon
+as it is found, followed by {"done": count}. An error is sent as
+{"error": message, "type": name}, which may follow some of the values.
+
+"""
+from functools import partial
+import json
+import os
+import SocketServer
+import sys
+import threading
+import time
+
+from evil.budget import Budget
+from evil.cache import CachedLookup, LRUCache
+from evil.index import PathIndex
+from evil.maths import maths_compile, maths_evil
+from evil.set import set_compile, stream_operators, stream_set_evil
+
+
+class EvilServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    """EvilServer evaluates the requests of each connection to a Unix socket
+    in its own thread.
+
+    :param path: The path of the socket to listen on.
+    :param interval: The number of seconds after which the index of a root
+                     is refreshed before it is next used.
+    :param cache_size: The number of compiled expressions, and of the results
+                       of patterns per root, to keep.
+
+    """
+
+    daemon_threads = True
+
+    def __init__(self, path, interval=1.0, cache_size=1024):
+        SocketServer.UnixStreamServer.__init__(self, path, EvilHandler)
+        self.interval = interval
+        self.cache_size = cache_size
+        self.plans = LRUCache(maxsize=cache_size)
+        self.roots = {}
+        self._lock = threading.Lock()
+
+    def evaluate(self, request):
+        """evaluate returns an iterator over the values of the result of a
+        request, which are found as they are read."""
+        expr = request["expr"]
+        evaluator = request.get("evaluator", "set")
+        if evaluator not in _COMPILERS:
+            raise ValueError("Unknown evaluator %r" % evaluator)
+        budget = _budget(request.get("budget"))
+
+        plan = self.plans.get((evaluator, expr))
+        if plan is None:
+            plan = _COMPILERS[evaluator](expr)
+            self.plans.set((evaluator, expr), plan)
+
+        if evaluator == "maths":
+            return iter([maths_evil(plan, budget=budget)])
+        if "root" not in request:
+            raise ValueError("Set expressions require a root")
+        lookup = self.root(request["root"]).lookup()
+        values = stream_set_evil(plan, lookup, budget=budget)
+        if budget is not None:
+            # The values of the result are merged as they are read, after
+            # the evaluation has returned, so its limits apply to them too.
+            values = budget.start().limit(values)
+        return values
+
+    def root(self, path):
+        """root returns the WarmRoot of a directory, creating it if needed.
+        Its index is built when it is first used, so that requests of other
+        roots need not wait for it."""
+        path = os.path.abspath(path)
+        with self._lock:
+            root = self.roots.get(path)
+            if root is None:
+                root = self.roots[path] = WarmRoot(path, self.interval,
+                                                   self.cache_size)
+        return root
+
+    def server_close(self):
+        SocketServer.UnixStreamServer.server_close(self)
+        try:
+            os.remove(self.server_address)
+        except OSError:
+            pass
+
+
+class EvilHandler(SocketServer.StreamRequestHandler):
+    """EvilHandler answers each request line of a connection in turn."""
+
+    def handle(self):
+        # readline, unlike iterating over the file, does not wait to fill its
+        # buffer before returning a request.
+        for line in iter(self.rfile.readline, ""):
+            try:
+                count = 0
+                for value in self.server.evaluate(json.loads(line)):
+                    self.send({"result": value})
+                    count += 1
+                self.send({"done": count})
+            except Exception as e:
+                self.send({"error": str(e), "type": type(e).__name__})
+            self.wfile.flush()
+
+    def send(self, response):
+        self.wfile.write(json.dumps(response) + "\n")
+
+
+class WarmRoot(object):
+    """WarmRoot keeps a PathIndex of a directory and the results of patterns
+    looked up in it, which are discarded once the index changes. The index is
+    built by the first lookup.
+
+    :param path: The directory to index.
+    :param interval: As given to EvilServer.
+    :param cache_size: As given to EvilServer.
+
+    """
+
+    def __init__(self, path, interval=1.0, cache_size=1024):
+        self.path = path
+        self.index = None
+        self.interval = interval
+        self.generation = 0
+        self.refreshed = None
+        self.cache = CachedLookup(self._lookup, maxsize=cache_size,
+                                  version=lambda: self.generation)
+        self._lock = threading.Lock()
+
+    def lookup(self):
+        """lookup returns the lookup to evaluate an expression with, having
+        refreshed the index if it is due."""
+        with self._lock:
+            if self.index is None:
+                self.index = PathIndex(self.path)
+                self.refreshed = time.time()
+            elif time.time() - self.refreshed >= self.interval:
+                if self.index.refresh():
+                    self.generation += 1
+                self.refreshed = time.time()
+        return self.cache
+
+    def _lookup(self, pattern):
+        with self._lock:
+            return list(self.index(pattern))
+
+
+_COMPILERS = {
+    "maths": maths_compile,
+    "set": partial(set_compile, operators=stream_operators()),
+}
+
+# The limits of Budget which a request may give
+_LIMITS = ("timeout", "max_size", "max_lookups", "max_magnitude")
+
+
+def _budget(limits):
+    if limits is None:
+        return None
+    unknown = sorted(name for name in limits if name not in _LIMITS)
+    if unknown:
+        raise ValueError("Unknown budget limits %s" % ", ".join(unknown))
+    return Budget(**dict((str(name), value)
+                         for name, value in limits.items()))
+
+
+def serve(path, interval=1.0, cache_size=1024):
+    """serve listens on the socket at path until interrupted."""
+    server = EvilServer(path, interval, cache_size)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        sys.exit("usage: python -m evil.server SOCKET")
+    serve(sys.argv[1])
@@ -1,28 +1,744 @@
+from collections import deque
+from functools import partial, reduce
+from heapq import merge
+from itertools import compress, islice, repeat
+import operator
+
 from evil import (
+    analyze,
     evil,
+    evil_async,
+    compile,
     op,
     expr_tokenizer,
+    evil_many,
+    explain,
+    Plan,
+    NODE_LOOKUP, NODE_APPLY, NODE_REDUCE,
 )
 
 
 def set_evil(expr, lookup, operators=None, cast=None, reducer=None,
-             tokenizer=None):
+             tokenizer=None, executor=None, pure=None, tracer=None,
+             budget=None, limit=None, order=False):
+    if limit is not None or order:
+        if cast is not None or reducer is not None or executor is not None:
+            raise ValueError("limit and order cannot be given with a cast, "
+                             "reducer or executor")
+        return limited_set_evil(expr, lookup, limit, order, operators,
+                                tokenizer, tracer, budget)
     if operators is None:
         operators = set_operators()
     if cast is None:
         cast = set
     if reducer is None:
-        reducer = lambda expr: set.union(*expr)
+        reducer = set_reducer
     if tokenizer is None:
         tokenizer = expr_tokenizer
     return evil(expr=expr, lookup=lookup, operators=operators, cast=cast,
-                reducer=reducer, tokenizer=tokenizer)
+                reducer=reducer, tokenizer=tokenizer, executor=executor,
+                pure=pure, tracer=tracer, budget=budget)
+
+
+def set_evil_many(exprs, lookup, operators=None, cast=None, reducer=None,
+                  tokenizer=None, executor=None, pure=None, tracer=None,
+                  budget=None):
+    """set_evil_many evaluates several expressions as set_evil does, sharing
+    lookups and identical subexpressions between them per evil_many.
+
+    :param pure: As given to evil_many. SET_PURE are the tokens of
+                 set_operators.
+    :returns: a list of the results of each expression. Identical results may
+              be the same set.
+
+    """
+    if operators is None:
+        operators = set_operators()
+    if cast is None:
+        cast = set
+    if reducer is None:
+        reducer = set_reducer
+    if tokenizer is None:
+        tokenizer = expr_tokenizer
+    return evil_many(exprs=exprs, lookup=lookup, operators=operators,
+                     cast=cast, reducer=reducer, tokenizer=tokenizer,
+                     executor=executor, pure=pure, tracer=tracer,
+                     budget=budget)
+
+
+def set_evil_async(expr, lookup, operators=None, cast=None, reducer=None,
+                   tokenizer=None, limit=None, loop=None):
+    """set_evil_async evaluates an expression as set_evil does, making its
+    lookups concurrently per evil_async.
+    """
+    if operators is None:
+        operators = set_operators()
+    if cast is None:
+        cast = set
+    if reducer is None:
+        reducer = set_reducer
+    if tokenizer is None:
+        tokenizer = expr_tokenizer
+    return evil_async(expr=expr, lookup=lookup, operators=operators,
+                      cast=cast, reducer=reducer, tokenizer=tokenizer,
+                      limit=limit, loop=loop)
+
+
+def set_compile(expr, operators=None, tokenizer=None):
+    """set_compile compiles an expression for repeated evaluation by set_evil.
+    """
+    if operators is None:
+        operators = set_operators()
+    if tokenizer is None:
+        tokenizer = expr_tokenizer
+    return compile(expr=expr, operators=operators, tokenizer=tokenizer)
+
+
+def set_explain(expr, operators=None, tokenizer=None):
+    """set_explain returns the Explanation of an expression per evil.explain.
+    """
+    if operators is None:
+        operators = set_operators()
+    if tokenizer is None:
+        tokenizer = expr_tokenizer
+    return explain(expr=expr, operators=operators, tokenizer=tokenizer)
+
+
+def set_analyze(expr, lookup, operators=None, cast=None, reducer=None,
+                tokenizer=None):
+    """set_analyze evaluates an expression as set_evil does, returning its
+    Explanation annotated per evil.analyze.
+    """
+    if operators is None:
+        operators = set_operators()
+    if cast is None:
+        cast = set
+    if reducer is None:
+        reducer = set_reducer
+    if tokenizer is None:
+        tokenizer = expr_tokenizer
+    return analyze(expr=expr, lookup=lookup, operators=operators, cast=cast,
+                   reducer=reducer, tokenizer=tokenizer)
+
+
+# The tokens of set_operators, none of which modify their arguments
+SET_PURE = ("=", "+", "-", ",")
 
 
 def set_operators():
+    # The operator module's functions, unlike the methods of set, can be
+    # pickled, as a process pool requires.
+    return [
+        op("=", operator.and_),
+        op("+", operator.or_),
+        op("-", operator.sub),
+        op(",", operator.or_),
+    ]
+
+
+def set_reducer(expr):
+    return set.union(*expr)
+
+
+def set_method(func):
+    """set_method returns set.intersection, set.union or set.difference where
+    func is one of them or their equivalent in the operator module, and None
+    otherwise."""
+    return _SET_METHODS.get(func)
+
+
+_SET_METHODS = {
+    set.intersection: set.intersection,
+    set.union: set.union,
+    set.difference: set.difference,
+    operator.and_: set.intersection,
+    operator.or_: set.union,
+    operator.sub: set.difference,
+}
+
+
+def planned_set_evil(expr, lookup, operators=None, estimate=None,
+                     tokenizer=None):
+    """planned_set_evil evaluates an expression as set_evil does, but orders
+    and skips lookups to do as little work as possible.
+
+    Intersections are evaluated smallest-first and stop once empty, and the
+    right side of a difference is not evaluated when the left is empty. The
+    result found so far is passed to lookups with a within(pattern,
+    candidates) method, which need only return the matches among the
+    candidates. Other operators are evaluated as by set_evil.
+
+    :param operators: As given to set_evil. The set.intersection,
+                      set.union and set.difference functions, and their
+                      equivalents per set_method, are recognised wherever
+                      they are used.
+    :param estimate: A callable returning an estimate of the number of results
+                     of looking up a pattern. Defaults to the estimate method
+                     of lookup, if there is one.
+    :returns: a set.
+
+    """
+    if not isinstance(expr, Plan):
+        expr = set_compile(expr, operators, tokenizer)
+    return SetPlanner(expr, lookup, estimate).evaluate()
+
+
+def inplace_set_evil(expr, lookup, operators=None, tokenizer=None,
+                     fresh=False):
+    """inplace_set_evil evaluates an expression as set_evil does, but updates
+    the intermediate sets it owns in place rather than copying them.
+
+    Sets returned by the lookup are only copied when they are not sets, or
+    must be modified but are not fresh. Unions update the larger of their
+    owned operands, so that the fewest values are added. Intersections update
+    the smaller, which contains their result, so that the fewest values are
+    removed, and the larger only where the smaller is not owned. Differences
+    update their owned left operand, and the result of a subexpression is not
+    copied.
+
+    :param operators: As given to set_evil. The set.intersection,
+                      set.union and set.difference functions, and their
+                      equivalents per set_method, are recognised wherever
+                      they are used.
+    :param fresh: Whether the lookup returns new sets, which can be modified.
+    :returns: a set.
+
+    """
+    if not isinstance(expr, Plan):
+        expr = set_compile(expr, operators, tokenizer)
+
+    # A value is owned if it was made during evaluation, and can be modified
+    # by the last node using it.
+    uses = expr.uses()
+    values = [None] * len(expr.nodes)
+    owned = [False] * len(expr.nodes)
+    for i, node in enumerate(expr.nodes):
+        if node.kind == NODE_LOOKUP:
+            value = lookup(node.token)
+            own = fresh
+            if type(value) is not set:
+                value, own = set(value), True
+        else:
+            args = [values[a] for a in node.args]
+            mutable = [owned[a] and uses[a] == 1 for a in node.args]
+            if node.kind == NODE_REDUCE:
+                func = set.union
+            else:
+                func = set_method(node.func) or node.func
+            if func in _INPLACE:
+                value, own = _INPLACE[func](args, mutable)
+            else:
+                value, own = func(*args), False
+            for a in node.args:
+                uses[a] -= 1
+                if not uses[a]:
+                    values[a] = None
+        values[i], owned[i] = value, own
+
+    root = expr.roots[-1]
+    return values[root] if owned[root] else set(values[root])
+
+
+def _inplace_union(values, mutable):
+    if len(values) == 1:
+        return values[0], mutable[0]
+    candidates = [i for i, m in enumerate(mutable) if m]
+    if candidates:
+        t = max(candidates, key=lambda i: len(values[i]))
+        target = values[t]
+    else:
+        t = max(range(len(values)), key=lambda i: len(values[i]))
+        target = set(values[t])
+    for i, value in enumerate(values):
+        if i != t:
+            target |= value
+    return target, True
+
+
+def _inplace_intersection(values, mutable):
+    # The result is within the smaller operand, so updating it removes the
+    # fewest values.
+    (a, mutable_a), (b, mutable_b) = sorted(zip(values, mutable),
+                                            key=lambda v: len(v[0]))
+    if mutable_a:
+        a &= b
+        return a, True
+    if mutable_b:
+        b &= a
+        return b, True
+    return a & b, True
+
+
+def _inplace_difference(values, mutable):
+    a, b = values
+    if mutable[0]:
+        a -= b
+        return a, True
+    return a - b, True
+
+
+_INPLACE = {
+    set.union: _inplace_union,
+    set.intersection: _inplace_intersection,
+    set.difference: _inplace_difference,
+}
+
+
+def stream_set_evil(expr, lookup, operators=None, tokenizer=None,
+                    budget=None):
+    """stream_set_evil evaluates an expression as set_evil does, but lazily
+    over sorted iterators, returning an iterator over the sorted result.
+
+    Only the current value of each lookup is held in memory, and results are
+    available as soon as they are found.
+
+    :param lookup: A callable returning an iterable of the results of a
+                   pattern in ascending order, such as globlookup or a
+                   StrIndex.
+    :param operators: As given to set_evil, acting on sorted iterators.
+                      Defaults to stream_operators.
+    :param budget: As given to set_evil. The values of each lookup are
+                   counted as they are read.
+    :raises: ValueError, from the iterator, where a lookup is out of order.
+    :returns: an iterator.
+
+    """
+    if operators is None:
+        operators = stream_operators()
+    return set_evil(expr=expr, lookup=lookup, operators=operators,
+                    cast=ascending, reducer=stream_reducer,
+                    tokenizer=tokenizer, budget=budget)
+
+
+def stream_operators():
     return [
-        op("=", set.intersection),
-        op("+", set.union),
-        op("-", set.difference),
-        op(",", set.union),
+        op("=", stream_intersection),
+        op("+", stream_union),
+        op("-", stream_difference),
+        op(",", stream_union),
     ]
+
+
+def stream_reducer(expr):
+    return stream_union(*expr)
+
+
+def ascending(iterable):
+    """ascending yields the distinct values of a sorted iterable.
+
+    :raises: ValueError where a value is less than the one before it.
+    """
+    last = _END
+    for value in iterable:
+        if last is not _END:
+            if value < last:
+                raise ValueError("%r is out of order, following %r"
+                                 % (value, last))
+            elif value == last:
+                continue
+        yield value
+        last = value
+
+
+def stream_union(*iterables):
+    """stream_union yields the distinct values of sorted iterables, in order.
+    """
+    last = _END
+    for value in merge(*iterables):
+        if last is _END or value != last:
+            yield value
+            last = value
+
+
+def stream_intersection(a, b):
+    """stream_intersection yields the values of both sorted iterables a and b,
+    in order."""
+    a, b = iter(a), iter(b)
+    x, y = next(a, _END), next(b, _END)
+    while x is not _END and y is not _END:
+        if x < y:
+            x = next(a, _END)
+        elif y < x:
+            y = next(b, _END)
+        else:
+            yield x
+            x, y = next(a, _END), next(b, _END)
+
+
+def stream_difference(a, b):
+    """stream_difference yields the values of sorted iterable a which are not
+    in sorted iterable b, in order."""
+    b = iter(b)
+    y = next(b, _END)
+    for x in a:
+        while y is not _END and y < x:
+            y = next(b, _END)
+        if y is _END or x != y:
+            yield x
+
+
+# The end of an iterator.
+_END = object()
+
+
+def limited_set_evil(expr, lookup, limit=None, order=False, operators=None,
+                     tokenizer=None, tracer=None, budget=None):
+    """limited_set_evil evaluates an expression as set_evil does, but lazily,
+    finding only as many results as the limit, if given.
+
+    Lookups are not made until their first value is needed, and their values
+    are read one at a time. Unions read their operands in turn, stopping as
+    soon as enough results are found, and intersections and differences read
+    their left operand, filtering it by the set of their right.
+
+    With order, lookups are merged as stream_set_evil does, so the result is
+    the smallest values of the full result.
+
+    :param limit: The greatest number of results to find, or None for all of
+                  them.
+    :param order: Whether to find the smallest results, in ascending order,
+                  rather than any results. The lookup must then return sets
+                  or values in ascending order, as given to stream_set_evil.
+    :param operators: As given to set_evil. The set.intersection, set.union
+                      and set.difference functions, and their equivalents
+                      per set_method, are evaluated lazily wherever they are
+                      used, and other operators are given
+                      sets of all the values of their operands.
+    :raises: ValueError, from the iterator, where a lookup is out of order.
+    :returns: a list of the results in ascending order, with order, or a set
+              of them otherwise.
+
+    """
+    if not isinstance(expr, Plan):
+        expr = set_compile(expr, operators, tokenizer)
+    if any(uses > 1 for uses in expr.uses()):
+        expr = _unshared(expr)
+
+    lazy = _STREAM if order else _LAZY
+    plan = Plan([
+        node._replace(func=lazy.get(set_method(node.func)) or
+                      partial(_eager, node.func, order))
+        if node.kind == NODE_APPLY else node
+        for node in expr.nodes
+    ], expr.roots)
+    values = plan.evaluate(partial(_deferred, lookup, order), iter,
+                           stream_reducer if order else lazy_reducer,
+                           tracer=tracer, budget=budget)
+    values = islice(values, limit)
+    return list(values) if order else set(values)
+
+
+def lazy_union(*iterables):
+    """lazy_union yields the distinct values of iterables, reading each in
+    turn."""
+    seen = set()
+    for iterable in iterables:
+        for value in iterable:
+            if value not in seen:
+                seen.add(value)
+                yield value
+
+
+def lazy_intersection(a, b):
+    """lazy_intersection yields the values of iterable a which are in
+    iterable b, reading b in full once a has a value."""
+    a = iter(a)
+    x = next(a, _END)
+    if x is _END:
+        return
+    b = _as_set(b)
+    if x in b:
+        yield x
+    for x in a:
+        if x in b:
+            yield x
+
+
+def lazy_difference(a, b):
+    """lazy_difference yields the values of iterable a which are not in
+    iterable b, reading b in full once a has a value."""
+    a = iter(a)
+    x = next(a, _END)
+    if x is _END:
+        return
+    b = _as_set(b)
+    if x not in b:
+        yield x
+    for x in a:
+        if x not in b:
+            yield x
+
+
+def lazy_reducer(expr):
+    if len(expr) == 1:
+        return expr[0]
+    return lazy_union(*expr)
+
+
+def _as_set(iterable):
+    if isinstance(iterable, (set, frozenset)):
+        return iterable
+    return set(iterable)
+
+
+def _deferred(lookup, order, pattern):
+    # Make the lookup of pattern once its first value is read, yielding its
+    # distinct values, in ascending order if required.
+    values = lookup(pattern)
+    if isinstance(values, (set, frozenset)):
+        if order:
+            values = sorted(values)
+    elif order:
+        values = ascending(values)
+    else:
+        values = lazy_union(values)
+    for value in values:
+        yield value
+
+
+def _eager(func, order, *iterables):
+    # Apply an operator which is not evaluated lazily to the sets of all the
+    # values of its operands.
+    value = func(*[_as_set(iterable) for iterable in iterables])
+    for v in sorted(value) if order else value:
+        yield v
+
+
+def _unshared(plan):
+    # Copy the nodes of the last root of plan once per use, so that each
+    # iterator is read by one operator.
+    nodes = []
+
+    def copy(i):
+        node = plan.nodes[i]
+        args = tuple(copy(a) for a in node.args)
+        nodes.append(node._replace(args=args))
+        return len(nodes) - 1
+
+    copy(plan.roots[-1])
+    return Plan(nodes)
+
+
+# The lazy equivalents of the set methods, as used by limited_set_evil.
+_LAZY = {
+    set.union: lazy_union,
+    set.intersection: lazy_intersection,
+    set.difference: lazy_difference,
+}
+_STREAM = {
+    set.union: stream_union,
+    set.intersection: stream_intersection,
+    set.difference: stream_difference,
+}
+
+
+def bitmap_set_evil(expr, lookup, universe, operators=None, tokenizer=None):
+    """bitmap_set_evil evaluates an expression as set_evil does, but with the
+    results of lookups encoded as bitmaps over the names of universe.
+
+    :param universe: The Universe used to encode and decode names.
+    :param operators: As given to set_evil, acting on bitmaps. Defaults to
+                      bitmap_operators.
+    :returns: a set of names.
+
+    """
+    if operators is None:
+        operators = bitmap_operators()
+    return universe.decode(set_evil(
+        expr=expr, lookup=lookup, operators=operators, cast=universe.encode,
+        reducer=bitmap_reducer, tokenizer=tokenizer,
+    ))
+
+
+def bitmap_operators():
+    return [
+        op("=", operator.and_),
+        op("+", operator.or_),
+        op("-", lambda a, b: a & ~b),
+        op(",", operator.or_),
+    ]
+
+
+def bitmap_reducer(expr):
+    return reduce(operator.or_, expr, 0)
+
+
+class Universe(object):
+    """Universe numbers names so that sets of them can be represented as
+    bitmaps: integers whose nth bit is set where the nth name is present.
+
+    :param names: The names to number. Other names are numbered as they are
+                  encoded.
+
+    """
+
+    def __init__(self, names=()):
+        self.names = []
+        self.ids = {}
+        for name in names:
+            self.intern(name)
+
+    def __len__(self):
+        return len(self.names)
+
+    def intern(self, name):
+        """intern returns the number of the given name."""
+        try:
+            return self.ids[name]
+        except KeyError:
+            self.ids[name] = len(self.names)
+            self.names.append(name)
+            return self.ids[name]
+
+    def encode(self, names):
+        """encode returns the bitmap of an iterable of names. Bitmaps, as may
+        be returned by lookups which cache their encoded results, are
+        returned as they are."""
+        if isinstance(names, (int, long)):
+            return names
+        if not isinstance(names, (list, tuple)):
+            names = list(names)
+        ids = list(map(self.ids.get, names))
+        if None in ids:
+            ids = [self.intern(name) if i is None else i
+                   for name, i in zip(names, ids)]
+        if not ids:
+            return 0
+        digits = bytearray(max(ids) + 1)
+        deque(map(digits.__setitem__, ids, repeat(1, len(ids))), maxlen=0)
+        digits.reverse()
+        return int(bytes(digits.translate(_BINARY_DIGITS)), 2)
+
+    def decode(self, bitmap):
+        """decode returns the set of names in a bitmap."""
+        digits = bytearray(bin(bitmap)[:1:-1], "ascii")
+        return set(compress(self.names, digits.translate(_BINARY_VALUES)))
+
+
+# Translations between the bytes 0 and 1 and the digits "0" and "1".
+_BINARY_DIGITS = bytes(bytearray(b"01") + bytearray(range(2, 256)))
+_BINARY_VALUES = bytes(bytearray(range(48)) + bytearray(b"\0\1") +
+                       bytearray(range(50, 256)))
+
+
+class SetPlanner(object):
+    """SetPlanner evaluates Plans of set expressions with the union reducer,
+    as described by planned_set_evil.
+
+    :param plan: The Plan to evaluate.
+    :param lookup: As given to set_evil.
+    :param estimate: As given to planned_set_evil.
+
+    """
+
+    def __init__(self, plan, lookup, estimate=None):
+        self.nodes = plan.nodes
+        self.lookup = lookup
+        self.within = getattr(lookup, "within", None)
+        if estimate is None:
+            estimate = getattr(lookup, "estimate", None)
+        self.costs = self._costs(estimate)
+
+    def evaluate(self):
+        """evaluate returns the result of the plan."""
+        return self._evaluate(len(self.nodes) - 1, None)
+
+    def _evaluate(self, i, within):
+        # Evaluate node i. Where within is given, only the part of the result
+        # within it is needed, so results may include anything else.
+        if within is not None and not within:
+            return set()
+
+        node = self.nodes[i]
+        kind = self._kind(node)
+        if node.kind == NODE_REDUCE and len(node.args) == 1:
+            return self._evaluate(node.args[0], within)
+        elif node.kind == NODE_LOOKUP:
+            if within is not None and self.within is not None:
+                return set(self.within(node.token, within))
+            return set(self.lookup(node.token))
+
+        elif kind is set.intersection:
+            operands = sorted(self._operands(i, kind), key=self._cost_key)
+            result = within
+            for j in operands:
+                if result is not None and not result:
+                    break
+                value = self._evaluate(j, result)
+                result = value if result is None else result & value
+            return result
+
+        elif kind is set.difference:
+            operands = self._operands(i, kind)
+            result = self._evaluate(operands[0], within)
+            for j in operands[1:]:
+                if not result:
+                    break
+                result = result - self._evaluate(j, result)
+            return result
+
+        elif kind is set.union:
+            result = set()
+            for j in self._operands(i, kind):
+                result |= self._evaluate(j, within)
+            return result
+
+        return node.func(*[self._evaluate(a, None) for a in node.args])
+
+    def _kind(self, node):
+        # The set operation performed by a node: reducers and parenthesized
+        # subexpressions are unions, as are their only values.
+        if node.kind == NODE_APPLY:
+            return set_method(node.func) or node.func
+        elif node.kind == NODE_LOOKUP:
+            return None
+        elif len(node.args) == 1:
+            return self._kind(self.nodes[node.args[0]])
+        return set.union
+
+    def _operands(self, i, kind):
+        # The operands of a chain of the same associative operation, or of a
+        # difference and the subtrahends of its left-nested differences, in
+        # the order they were written.
+        operands = []
+        pending = [(i, True)]
+        while pending:
+            j, nested = pending.pop()
+            if not nested:
+                operands.append(j)
+                continue
+            args = self.nodes[j].args
+            for n in range(len(args) - 1, -1, -1):
+                nested = self._kind(self.nodes[args[n]]) is kind and (
+                    kind is not set.difference or n == 0)
+                pending.append((args[n], nested))
+        return operands
+
+    def _cost_key(self, i):
+        # Order operands by estimated cost, with unestimated operands last.
+        cost = self.costs[i]
+        return (cost is None, cost)
+
+    def _costs(self, estimate):
+        # Estimate the size of each node's result from those of its operands.
+        costs = []
+        for node in self.nodes:
+            args = [costs[a] for a in node.args]
+            kind = self._kind(node)
+            if estimate is None:
+                cost = None
+            elif node.kind == NODE_REDUCE and len(node.args) == 1:
+                cost = args[0]
+            elif node.kind == NODE_LOOKUP:
+                cost = estimate(node.token)
+            elif kind is set.intersection:
+                known = [c for c in args if c is not None]
+                cost = min(known) if known else None
+            elif kind is set.difference:
+                cost = args[0]
+            elif kind is set.union and None not in args:
+                cost = sum(args)
+            else:
+                cost = None
+            costs.append(cost)
+        return costs
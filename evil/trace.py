@@ -0,0 +1,196 @@
+import threading
+import time
+
+
+class Tracer(object):
+    """Tracer is given measurements of the compilation and evaluation of
+    expressions by evil, compile and Plan.evaluate. Its methods do nothing,
+    and subclasses override those they need.
+
+    Times are in seconds, as measured by the timer attribute. Sizes are the
+    lengths of values, or None for values without a length.
+
+    """
+
+    timer = staticmethod(time.time)
+
+    def compiled(self, expr, tokenize, parse):
+        """compiled is called once an expression is compiled, with the time
+        spent tokenizing and parsing it."""
+
+    def lookup(self, pattern, seconds, size):
+        """lookup is called after a pattern is looked up and cast."""
+
+    def apply(self, token, seconds, size):
+        """apply is called after an operator is applied."""
+
+    def reduce(self, seconds, size):
+        """reduce is called after a (sub)expression is reduced."""
+
+
+class Stats(Tracer):
+    """Stats is a Tracer which totals its measurements, per pattern and per
+    operator, until it is reset. It is safe to use from several threads.
+
+    :param timer: A callable returning the current time in seconds.
+
+    """
+
+    def __init__(self, timer=time.time):
+        self.timer = timer
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """reset discards all measurements."""
+        with self._lock:
+            self.compilations = 0
+            self.tokenize_time = 0.0
+            self.parse_time = 0.0
+            self.lookups = {}
+            self.operators = {}
+            self.reductions = Totals()
+            self.peak_size = 0
+
+    def compiled(self, expr, tokenize, parse):
+        with self._lock:
+            self.compilations += 1
+            self.tokenize_time += tokenize
+            self.parse_time += parse
+
+    def lookup(self, pattern, seconds, size):
+        with self._lock:
+            self._add(self.lookups, pattern, seconds, size)
+
+    def apply(self, token, seconds, size):
+        with self._lock:
+            self._add(self.operators, token, seconds, size)
+
+    def reduce(self, seconds, size):
+        with self._lock:
+            self.reductions.add(seconds, size)
+            self._peak(size)
+
+    def hottest(self, n=10):
+        """hottest returns the n patterns with the greatest total lookup time,
+        as (pattern, Totals) tuples, slowest first."""
+        with self._lock:
+            lookups = list(self.lookups.items())
+        lookups.sort(key=lambda item: item[1].time, reverse=True)
+        return lookups[:n]
+
+    def snapshot(self, reset=False):
+        """snapshot returns the measurements as a dictionary of plain values,
+        ready to be exported.
+
+        :param reset: Whether to discard the measurements once taken.
+
+        """
+        with self._lock:
+            snapshot = {
+                "compilations": self.compilations,
+                "tokenize_time": self.tokenize_time,
+                "parse_time": self.parse_time,
+                "lookups": dict((pattern, totals.as_dict())
+                                for pattern, totals in self.lookups.items()),
+                "operators": dict((token, totals.as_dict())
+                                  for token, totals in self.operators.items()),
+                "reductions": self.reductions.as_dict(),
+                "peak_size": self.peak_size,
+            }
+        if reset:
+            self.reset()
+        return snapshot
+
+    def _add(self, totals, key, seconds, size):
+        try:
+            entry = totals[key]
+        except KeyError:
+            entry = totals[key] = Totals()
+        entry.add(seconds, size)
+        self._peak(size)
+
+    def _peak(self, size):
+        if size is not None:
+            self.peak_size = max(self.peak_size, size)
+
+
+class Totals(object):
+    """Totals counts the calls made of a lookup, operator or reducer, their
+    total and greatest times, and the total and greatest sizes of their
+    results."""
+
+    def __init__(self):
+        self.count = 0
+        self.time = 0.0
+        self.max_time = 0.0
+        self.size = 0
+        self.max_size = 0
+
+    def add(self, seconds, size):
+        self.count += 1
+        self.time += seconds
+        self.max_time = max(self.max_time, seconds)
+        if size is not None:
+            self.size += size
+            self.max_size = max(self.max_size, size)
+
+    def as_dict(self):
+        return {
+            "count": self.count,
+            "time": self.time,
+            "max_time": self.max_time,
+            "size": self.size,
+            "max_size": self.max_size,
+        }
+
+
+def _size(value):
+    try:
+        return len(value)
+    except TypeError:
+        return None
+
+
+def _traced_lookup(tracer, lookup, cast, pattern):
+    start = tracer.timer()
+    value = cast(lookup(pattern))
+    tracer.lookup(pattern, tracer.timer() - start, _size(value))
+    return value
+
+
+def _traced_apply(tracer, token, func, *args):
+    start = tracer.timer()
+    value = func(*args)
+    tracer.apply(token, tracer.timer() - start, _size(value))
+    return value
+
+
+def _traced_reduce(tracer, reducer, values):
+    start = tracer.timer()
+    value = reducer(values)
+    tracer.reduce(tracer.timer() - start, _size(value))
+    return value
+
+
+class _TimedIterator(object):
+    # Totals the time spent calling func and producing the items of the
+    # iterable it returns.
+
+    def __init__(self, timer, func, *args):
+        self.timer = timer
+        start = timer()
+        self.iterator = iter(func(*args))
+        self.seconds = timer() - start
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        start = self.timer()
+        try:
+            return next(self.iterator)
+        finally:
+            self.seconds += self.timer() - start
+
+    __next__ = next
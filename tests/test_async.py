@@ -0,0 +1,69 @@
+from unittest import TestCase, skipIf
+
+from tests import eq_
+
+from evil import asyncio
+from evil.maths import maths_evil_async
+from evil.set import set_evil, set_evil_async
+
+
+@skipIf(asyncio is None, "asyncio is not installed")
+class EvilAsyncTestCase(TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.running = 0
+        self.concurrency = 0
+        self.seen = []
+
+    def tearDown(self):
+        self.loop.close()
+
+    def lookup(self, pattern):
+        # Look up pattern in a space of letters, after a short delay
+        def finish():
+            self.running -= 1
+            if future.cancelled():
+                return
+            elif pattern == "error":
+                future.set_exception(KeyError(pattern))
+            else:
+                future.set_result(c for c in "abcdef" if c in pattern)
+
+        self.seen.append(pattern)
+        self.running += 1
+        self.concurrency = max(self.concurrency, self.running)
+        future = asyncio.Future(loop=self.loop)
+        self.loop.call_later(0.01, finish)
+        return future
+
+    def wait(self, future):
+        return self.loop.run_until_complete(future)
+
+    def test_set_evil_async(self):
+        expr = "abc = (bcd + ef) - (c, abc)"
+        eq_(self.wait(set_evil_async(expr, self.lookup, loop=self.loop)),
+            set_evil(expr, lambda pattern: set(pattern)) & set("abcdef"))
+        eq_(self.seen, ["abc", "bcd", "ef", "c"])
+        eq_(self.concurrency, 4)
+
+    def test_set_evil_async_limit(self):
+        expr = "a, b, c, d, e, f"
+        eq_(self.wait(set_evil_async(expr, self.lookup, limit=2,
+                                    loop=self.loop)),
+            set("abcdef"))
+        eq_(self.concurrency, 2)
+
+    def test_set_evil_async_error(self):
+        result = set_evil_async("a + error + b", self.lookup, loop=self.loop)
+        self.assertRaises(KeyError, self.wait, result)
+
+    def test_maths_evil_async(self):
+        def lookup(token):
+            future = asyncio.Future(loop=self.loop)
+            self.loop.call_soon(future.set_result, len(token))
+            return future
+
+        eq_(self.wait(maths_evil_async("aa * (bbb + 1)", lookup,
+                                      loop=self.loop)), 8)
+        eq_(self.wait(maths_evil_async("2 ^ 8", loop=self.loop)), 256)
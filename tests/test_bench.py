@@ -0,0 +1,27 @@
+from unittest import TestCase
+
+from tests import eq_
+
+from benchmarks.suite import WORKLOADS, compare, run
+
+
+class EvilBenchmarkTestCase(TestCase):
+
+    def test_run(self):
+        report = run(scale=0.001, repeat=1)
+        names = set(func.__name__ for func in WORKLOADS)
+        self.assertTrue(set(report["benchmarks"]) <= names)
+        self.assertTrue(len(report["benchmarks"]) >= len(names) - 1)
+        for result in report["benchmarks"].values():
+            eq_(len(result["times"]), 1)
+
+    def test_compare(self):
+        baseline = {"benchmarks": {"a": {"seconds": 1.0},
+                                   "b": {"seconds": 1.0},
+                                   "c": {"seconds": 1.0}}}
+        report = {"benchmarks": {"a": {"seconds": 1.2},
+                                 "b": {"seconds": 1.5},
+                                 "d": {"seconds": 9.0}}}
+        eq_(compare(report, baseline), [("b", 1.0, 1.5)])
+        eq_(compare(report, baseline, threshold=0.1),
+            [("a", 1.0, 1.2), ("b", 1.0, 1.5)])
@@ -0,0 +1,81 @@
+from unittest import TestCase
+
+from tests import eq_
+
+from evil.budget import Budget, BudgetExceeded
+from evil.maths import maths_evil
+from evil.set import set_evil, set_evil_many
+
+
+class EvilBudgetTestCase(TestCase):
+
+    def assertExceeds(self, limit, func, *args, **kwargs):
+        try:
+            func(*args, **kwargs)
+        except BudgetExceeded as e:
+            eq_(e.limit, limit)
+        else:
+            raise AssertionError("BudgetExceeded was not raised")
+
+    def test_within_budget(self):
+        budget = Budget(timeout=10, max_size=3, max_lookups=3,
+                        max_magnitude=1000)
+        eq_(set_evil("abc - b, cd", set, budget=budget), set("acd"))
+        eq_(maths_evil("3! ^ 3 - 16", budget=budget), 200)
+        eq_(set_evil_many(["ab", "ab = bc"], set, budget=budget),
+            [set("ab"), set("b")])
+
+    def test_max_lookups(self):
+        budget = Budget(max_lookups=2)
+        eq_(set_evil("a, b", set, budget=budget), set("ab"))
+        self.assertExceeds("lookups", set_evil, "a, b, c", set, budget=budget)
+
+    def test_max_size(self):
+        budget = Budget(max_size=3)
+        self.assertExceeds("size", set_evil, "abcd = abc", set, budget=budget)
+        self.assertExceeds("size", set_evil, "ab, cd", set, budget=budget)
+
+        # The values of a lookup without a length are counted as they are
+        # read, and reading stops at the first value too many.
+        read = []
+        lookup = lambda pattern: (read.append(c) or c for c in pattern)
+        self.assertExceeds("size", set_evil, "abcdefgh", lookup,
+                           budget=budget)
+        eq_(read, list("abcd"))
+
+    def test_max_magnitude(self):
+        budget = Budget(max_magnitude=10 ** 6)
+        eq_(maths_evil("9!", budget=budget), 362880)
+        self.assertExceeds("magnitude", maths_evil, "10 * 100000 * 2",
+                           budget=budget)
+
+        # Factorials and powers which are too great are not calculated.
+        self.assertExceeds("magnitude", maths_evil, "100000000!",
+                           budget=budget)
+        self.assertExceeds("magnitude", maths_evil, "99 ^ 100000000",
+                           budget=budget)
+
+    def test_timeout(self):
+        now = [0]
+
+        def lookup(pattern):
+            now[0] += 1
+            return pattern
+
+        budget = Budget(timeout=1.5, timer=lambda: now[0])
+        eq_(set_evil("a", lookup, budget=budget), set("a"))
+        self.assertExceeds("timeout", set_evil, "a, b, c", lookup,
+                           budget=budget)
+        eq_(now[0], 3)
+
+    def test_cancel(self):
+        budget = Budget()
+
+        def lookup(pattern):
+            if pattern == "b":
+                budget.cancel()
+            return pattern
+
+        self.assertExceeds("cancelled", set_evil, "a, b, c", lookup,
+                           budget=budget)
+        self.assertExceeds("cancelled", set_evil, "a", set, budget=budget)
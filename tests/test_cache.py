@@ -0,0 +1,62 @@
+from unittest import TestCase
+
+from tests import eq_
+
+from evil.cache import CachedLookup, LRUCache
+from evil.set import set_compile, set_evil
+
+
+class EvilCacheTestCase(TestCase):
+
+    def test_lru_cache(self):
+        cache = LRUCache(maxsize=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        eq_(cache.get("a"), 1)
+        cache.set("c", 3)
+        eq_(cache.get("b"), None)
+        eq_(cache.get("a"), 1)
+        eq_(len(cache), 2)
+
+    def test_cached_lookup_scope(self):
+        seen = []
+
+        def lookup(pattern):
+            seen.append(pattern)
+            return iter(pattern)
+
+        cached = CachedLookup(lookup, maxsize=0)
+        plan = set_compile("ab + (ba = ab)")
+        eq_(set_evil(plan, cached), set("ab"))
+        eq_(seen, ["ab", "ba"])
+        eq_((cached.hits, cached.misses), (1, 2))
+
+        eq_(set_evil(plan, cached), set("ab"))
+        eq_(seen, ["ab", "ba", "ab", "ba"])
+
+    def test_cached_lookup_eviction(self):
+        now = [0]
+        version = ["v1"]
+        seen = []
+
+        def lookup(pattern):
+            seen.append(pattern)
+            return set(pattern)
+
+        cached = CachedLookup(lookup, maxsize=2, ttl=10,
+                              version=lambda: version[0],
+                              timer=lambda: now[0])
+        for pattern in ["a", "b", "a", "c", "b"]:
+            eq_(cached(pattern), set(pattern))
+        eq_(seen, ["a", "b", "c", "b"])
+        eq_((cached.hits, cached.misses), (1, 4))
+
+        now[0] = 20
+        cached("b")
+        eq_(seen[-1:], ["b"])
+
+        version[0] = "v2"
+        cached("c")
+        cached("c")
+        eq_(seen[-2:], ["b", "c"])
+        eq_(cached.misses, 6)
@@ -1,11 +1,17 @@
 from functools import partial
-from unittest import TestCase
+from unittest import TestCase, skipIf
 
-from tests import eq_
+from tests import eq_, raises
 
 from evil import op, strlookup
+from evil.dag import CycleError, DAG, dag_evil
 from evil.set import set_evil, set_operators
 
+try:
+    from concurrent.futures import ProcessPoolExecutor
+except ImportError:
+    ProcessPoolExecutor = None
+
 
 class EvilDAGTestCase(TestCase):
 
@@ -65,3 +71,86 @@ class EvilDAGTestCase(TestCase):
             set_evil("^*.b = *.a", node_lookup, node_operators),
             set(["a.a", "b.a", "c.a"])
         )
+
+    graph = {
+        "a.a": [],
+        "a.b": ["a.a"],
+        "b.a": ["a.b"],
+        "b.b": ["b.a"],
+        "c.a": ["a.b"],
+        "c.b": ["c.a"],
+    }
+
+    def test_dag(self):
+        dag = DAG(self.graph)
+        eq_(dag("a.*"), ["a.a", "a.b"])
+        eq_(dag.dependencies(["b.a"]), set(["a.a", "a.b", "b.a"]))
+        eq_(dag.dependents(["a.b"]), set(["a.b", "b.a", "b.b", "c.a", "c.b"]))
+        eq_(dag_evil("^*.b = *.a", dag), set(["a.a", "b.a", "c.a"]))
+        eq_(dag_evil("~a.b - ^c.b", dag), set(["b.a", "b.b"]))
+
+        order = dag.order()
+        for node, dependencies in self.graph.items():
+            for dependency in dependencies:
+                self.assertTrue(order.index(dependency) < order.index(node))
+
+    def test_dag_diamonds(self):
+        # Each level depends on both nodes of the level beneath it, giving
+        # 2 ** 200 paths from the top to the bottom.
+        graph = {"0.l": [], "0.r": []}
+        for level in range(1, 201):
+            below = ["%d.l" % (level - 1), "%d.r" % (level - 1)]
+            graph["%d.l" % level] = graph["%d.r" % level] = below
+        dag = DAG(graph)
+        eq_(len(dag.dependencies(["200.l"])), 401)
+        eq_(dag_evil("^200.* = 1*", dag), set(["1.l", "1.r"] + [
+            "%d.%s" % (level, side)
+            for level in range(10, 20) + range(100, 200) for side in "lr"
+        ]))
+
+    def test_dag_chain(self):
+        # Only the closures of the nodes queried are kept, so a deep chain
+        # costs no more than its length.
+        n = 20000
+        dag = DAG(dict((i, [i - 1] if i else []) for i in range(n)))
+        eq_(dag.dependencies([n / 2]), set(range(n / 2 + 1)))
+        eq_(dag.dependencies([n - 1]), set(range(n)))
+        eq_(dag.dependents([0, n / 2]), set(range(n)))
+        eq_(len(dag._ups), 2)
+        eq_(len(dag._downs), 0)
+
+        dag.remove_edge(n / 2, n / 2 - 1)
+        eq_(dag.dependencies([n - 1]), set(range(n / 2, n)))
+        eq_(dag.dependents([0]), set(range(n / 2)))
+
+    def test_dag_updates(self):
+        dag = DAG(self.graph)
+        eq_(dag_evil("^b.b", dag), set(["a.a", "a.b", "b.a", "b.b"]))
+        dag.add("d.a", ["b.b", "c.a"])
+        eq_(dag.dependencies(["d.a"]),
+            set(["a.a", "a.b", "b.a", "b.b", "c.a", "d.a"]))
+        eq_(dag_evil("~b.b", dag), set(["b.b", "d.a"]))
+        dag.remove_edge("b.a", "a.b")
+        eq_(dag_evil("^b.b", dag), set(["b.a", "b.b"]))
+        eq_(dag.dependents(["a.a"]), set(["a.a", "a.b", "c.a", "c.b", "d.a"]))
+        dag.remove("c.a")
+        eq_(dag.dependencies(["d.a"]), set(["b.a", "b.b", "d.a"]))
+        eq_(dag("c.*"), ["c.b"])
+
+    def test_dag_cycles(self):
+        dag = DAG(self.graph)
+        with self.assertRaises(CycleError) as context:
+            dag.add_edge("a.a", "b.b")
+        eq_(context.exception.nodes, ["a.a", "b.b"])
+        eq_(dag.dependencies(["a.a"]), set(["a.a"]))
+
+    @skipIf(ProcessPoolExecutor is None, "concurrent.futures is not installed")
+    def test_dag_process_executor(self):
+        dag = DAG(self.graph)
+        with ProcessPoolExecutor(max_workers=2) as executor:
+            eq_(dag_evil("^*.b = *.a", dag, executor=executor),
+                set(["a.a", "b.a", "c.a"]))
+
+    @raises(CycleError)
+    def test_dag_cyclic_graph(self):
+        DAG({"a": ["b"], "b": ["c"], "c": ["a"]})
@@ -1,19 +1,38 @@
 from functools import partial
-from unittest import TestCase
+from StringIO import StringIO
+import random
+import time
+from unittest import TestCase, skipIf
 
 from tests import eq_, raises
 
 from evil import (
+    analyze,
+    compile,
+    explain,
     op,
+    NODE_LOOKUP,
     OP_BOTH, OP_LEFT, OP_RIGHT,
     expr_tokenizer,
     strlookup,
+    tokenizer_grammar,
 )
 
+from evil.maths import maths_evil
 from evil.set import (
+    SET_PURE,
+    set_analyze,
+    set_compile,
     set_evil,
+    set_evil_many,
+    set_operators,
 )
 
+try:
+    from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+except ImportError:
+    ProcessPoolExecutor = ThreadPoolExecutor = None
+
 
 class EvilHelperTestCase(TestCase):
 
@@ -57,6 +76,42 @@ class EvilHelperTestCase(TestCase):
             ["^", "^", "^", "(", "a", ",", "b", "+", "c", ")"]
         )
 
+    def test_expr_tokenizer_overlapping(self):
+        operator_tokens = ["(", ")", "<", "<=", "<>", "a b"]
+        eq_(
+            list(expr_tokenizer("x<=y<>(z<w)a bc a\tb", operator_tokens)),
+            ["x", "<=", "y", "<>", "(", "z", "<", "w", ")", "a b", "c",
+             "a", "b"]
+        )
+        eq_(operator_tokens, ["(", ")", "<", "<=", "<>", "a b"])
+
+    def test_expr_tokenizer_streaming(self):
+        expr = "^^ ^ (abc, def + ^^g) ^"
+        operator_tokens = ["^", "^^", "(", ")", "+", "-", ","]
+        tokens = list(expr_tokenizer(expr, operator_tokens))
+        for size in range(1, len(expr) + 1):
+            chunks = [expr[i:i + size] for i in range(0, len(expr), size)]
+            eq_(list(expr_tokenizer(chunks, operator_tokens)), tokens)
+        eq_(list(expr_tokenizer(StringIO(expr), operator_tokens)), tokens)
+
+    def test_tokenizer_grammar(self):
+        grammar = tokenizer_grammar(["+", "(", ")"])
+        eq_(tokenizer_grammar(["(", ")", "+", "+"]), grammar)
+        eq_(grammar.match("a++", 1), "+")
+        eq_(grammar.match("a++", 0), None)
+
+    def test_tokenizer_grammar_single_characters(self):
+        # Operators of a single character split strings by a regex, which
+        # gives the tokens of a stream of the same string.
+        operator_tokens = ["(", ")", "=", "+", "-", ",", "]", "\\"]
+        self.assertTrue(tokenizer_grammar(operator_tokens).split is not None)
+        for expr in ["", " ", "(a.* +b\\c)=d]e,\tf ", "a- -b"]:
+            eq_(list(expr_tokenizer(expr, operator_tokens)),
+                list(expr_tokenizer([expr], operator_tokens)))
+        eq_(list(expr_tokenizer("(a.*+ b) =c]", operator_tokens)),
+            ["(", "a.*", "+", "b", ")", "=", "c", "]"])
+        eq_(tokenizer_grammar(["(", ")", "=="]).split, None)
+
 
 class EvilTestCase(TestCase):
 
@@ -129,3 +184,240 @@ class EvilTestCase(TestCase):
     def test_set_evil_op_double(self):
         eq_(set_evil("a > > b", lambda t: set(), self.left_right_ops()), set())
         eq_(set_evil("a < < b", lambda t: set(), self.left_right_ops()), set())
+
+
+class EvilCompileTestCase(TestCase):
+
+    def test_compile_once(self):
+        calls = []
+
+        def tokenizer(expr, operator_tokens):
+            calls.append(expr)
+            return expr_tokenizer(expr, operator_tokens)
+
+        plan = compile("a = (b + c)", set_operators(), tokenizer)
+        eq_(plan.patterns(), ["a", "b", "c"])
+
+        spaces = [
+            {"a": "xy", "b": "x", "c": "z"},
+            {"a": "z", "b": "x", "c": "z"},
+        ]
+        for space, result in zip(spaces, [set("x"), set("z")]):
+            eq_(plan.evaluate(space.get, set, lambda e: set.union(*e)),
+                result)
+            eq_(set_evil(plan, space.get), result)
+        eq_(calls, ["a = (b + c)"])
+
+    def test_compile_cached(self):
+        calls = []
+
+        def tokenizer(expr, operator_tokens):
+            calls.append(expr)
+            return expr_tokenizer(expr, operator_tokens)
+
+        # Plans of strings are reused across calls with the same operators,
+        # tokenizer and pure operators.
+        space = {"a": "xy", "b": "x", "c": "z"}
+        for pure in [None, None, SET_PURE, SET_PURE]:
+            eq_(set_evil("a = (b + c)", space.get, tokenizer=tokenizer,
+                         pure=pure), set("x"))
+        eq_(calls, ["a = (b + c)"] * 2)
+
+        class Union(object):
+            __hash__ = None
+
+            def __call__(self, a, b):
+                return a | b
+
+        del calls[:]
+        for _ in range(2):
+            eq_(set_evil("b + c", space.get, [op("+", Union())],
+                         tokenizer=tokenizer), set("xz"))
+        eq_(calls, ["b + c"] * 2)
+
+    def test_compile_lookup_order(self):
+        seen = []
+
+        def lookup(token):
+            seen.append(token)
+            return set([token])
+
+        eq_(set_evil(set_compile("(a + b) = (c, a) - d"), lookup),
+            set(["a"]))
+        eq_(seen, ["a", "b", "c", "a", "d"])
+
+    @raises(SyntaxError)
+    def test_compile_syntax_error(self):
+        set_compile("a = (b +)")
+
+    def plan_tree(self, plan):
+        trees = []
+        for node in plan.nodes:
+            if node.kind == NODE_LOOKUP:
+                trees.append(node.token)
+            else:
+                args = tuple(trees[a] for a in node.args)
+                trees.append((node.token,) + args)
+        return trees[-1]
+
+    def test_compile_engines(self):
+        rand = random.Random(0)
+        for i in range(2000):
+            symbols = rand.sample("!#$%&*+-/<>=~", rand.randint(1, 5))
+            operators = [
+                op(symbol, None, **rand.choice([{}, {"left": True},
+                                                {"right": True}]))
+                for symbol in symbols
+            ]
+            expr = " ".join(rand.choice(symbols + ["a", "b", "(", ")"])
+                            for _ in range(rand.randint(0, 9)))
+
+            trees = []
+            for engine in ["linear", "rescan"]:
+                try:
+                    plan = compile(expr, operators, expr_tokenizer, engine)
+                    trees.append(self.plan_tree(plan))
+                except SyntaxError as e:
+                    trees.append(e.args)
+            eq_(trees[0], trees[1], "%r: %r != %r" % (expr, trees[0],
+                                                     trees[1]))
+
+    def test_compile_pure(self):
+        calls = []
+
+        def union(a, b):
+            calls.append((a, b))
+            return a | b
+
+        operators = [op("+", union), op("-", set.difference)]
+        space = {"a": "ab", "b": "bc", "c": "a"}
+        plan = compile("((a + b) - (a + b)) + c", operators, expr_tokenizer,
+                       pure=("+",))
+        eq_(plan.patterns(), ["a", "b", "c"])
+        eq_(plan.evaluate(space.get, set, lambda e: set.union(*e)),
+            set("a"))
+        eq_(len(calls), 2)
+
+        # Arguments of impure operators are not shared
+        plan = compile("(a + b) - (a + b)", operators, expr_tokenizer,
+                       pure=("-",))
+        eq_(plan.patterns(), ["a", "b", "a", "b"])
+
+        # Nothing is shared unless pure operators are given
+        seen = []
+
+        def lookup(token):
+            seen.append(token)
+            return token
+
+        for pure in [None, ()]:
+            del seen[:]
+            eq_(set_evil("a , a , (b) , (b)", lookup, pure=pure), set("ab"))
+            eq_(seen, ["a", "a", "b", "b"])
+        del seen[:]
+        eq_(set_evil("a , a , (b) , (b)", lookup, pure=SET_PURE), set("ab"))
+        eq_(seen, ["a", "b"])
+
+    def test_evil_many(self):
+        seen = []
+
+        def lookup(token):
+            seen.append(token)
+            return token
+
+        exprs = ["(a + b) = a", "a = (a + b)", "(a + b) = a", "c"]
+        eq_(set_evil_many(exprs, lookup, pure=SET_PURE),
+            [set("a"), set("a"), set("a"), set("c")])
+        eq_(seen, ["a", "b", "c"])
+
+        del seen[:]
+        eq_(set_evil_many(exprs, lookup),
+            [set("a"), set("a"), set("a"), set("c")])
+        eq_(seen, ["a", "b", "a", "a", "a", "b", "a", "b", "a", "c"])
+
+    def test_explain(self):
+        operators = [op("!", None, left=True)] + set_operators()
+        explanation = explain("(a + b!) = c, d", operators, expr_tokenizer)
+        eq_(str(explanation), "\n".join([
+            "reduce",
+            "  apply , (both)",
+            "    apply = (both)",
+            "      reduce",
+            "        apply + (both)",
+            "          lookup a",
+            "          apply ! (left)",
+            "            lookup b",
+            "      lookup c",
+            "    lookup d",
+        ]))
+        eq_(explanation.as_dict()["children"][0]["children"][1], {
+            "kind": "lookup", "token": "d", "side": None, "size": None,
+            "seconds": None, "children": [],
+        })
+
+    def test_analyze(self):
+        explanation = set_analyze("(ab + bc) = c, d", set)
+        eq_([child.size for child in explanation.children[0].children],
+            [1, 1])
+        eq_(explanation.children[0].children[0].children[0].size, 3)
+        eq_(explanation.size, 2)
+        self.assertTrue(explanation.seconds >= 0)
+
+        explanation = analyze("ab = b", set, set_operators(), set,
+                              lambda e: set.union(*e), expr_tokenizer,
+                              timer=iter(range(100)).next)
+        eq_(str(explanation), "\n".join([
+            "reduce size=1 time=1000.000ms",
+            "  apply = (both) size=1 time=1000.000ms",
+            "    lookup ab size=2 time=1000.000ms",
+            "    lookup b size=1 time=1000.000ms",
+        ]))
+
+
+@skipIf(ThreadPoolExecutor is None, "concurrent.futures is not installed")
+class EvilParallelTestCase(TestCase):
+
+    def slow_lookup(self, pattern):
+        # Patterns give their delay in hundredths of a second after "."
+        pattern, delay = pattern.split(".")
+        time.sleep(int(delay) / 100.0)
+        if pattern == "error":
+            raise KeyError(delay)
+        return set(pattern)
+
+    def test_set_evil_executor(self):
+        expr = "(ab.4 = bc.3) + (cd.3 - d.2), (ef.2 = e.1)"
+        with ThreadPoolExecutor(max_workers=6) as executor:
+            start = time.time()
+            result = set_evil(expr, self.slow_lookup, executor=executor)
+            elapsed = time.time() - start
+        eq_(result, set_evil(expr, lambda p: set(p.split(".")[0])))
+        eq_(result, set("bce"))
+        self.assertTrue(elapsed < 0.1, elapsed)
+
+    def test_set_evil_executor_error(self):
+        # The first error in evaluation order is raised, as without executor
+        for expr in ["error.5 + error.1", "(a.1 = error.5) - (error.1)"]:
+            with ThreadPoolExecutor(max_workers=4) as executor:
+                try:
+                    set_evil(expr, self.slow_lookup, executor=executor)
+                except KeyError as e:
+                    eq_(e.args, ("5",))
+                else:
+                    raise AssertionError("KeyError not raised")
+
+    def test_maths_evil_process_executor(self):
+        with ProcessPoolExecutor(max_workers=2) as executor:
+            eq_(maths_evil("(2 + 2)! * (3 - 1) ^ 2", executor=executor), 96)
+
+    def test_set_evil_process_executor(self):
+        lookup = partial(strlookup, space=["a.a", "a.b", "b.a"])
+        with ProcessPoolExecutor(max_workers=2) as executor:
+            eq_(set_evil("a.* - *.b, b.*", lookup, executor=executor),
+                set(["a.a", "b.a"]))
+
+    @raises(TypeError)
+    def test_set_evil_process_executor_unpicklable(self):
+        # A lambda cannot be pickled, which is raised rather than waited on
+        with ProcessPoolExecutor(max_workers=2) as executor:
+            set_evil("a + b", lambda p: set(p), executor=executor)
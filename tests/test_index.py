@@ -0,0 +1,93 @@
+from functools import partial
+from tempfile import mkdtemp
+from unittest import TestCase
+import os
+import shutil
+import time
+
+from tests import eq_
+
+from evil import globlookup, strlookup
+from evil.index import PathIndex, StrIndex
+from evil.set import set_evil
+
+
+class EvilIndexTestCase(TestCase):
+
+    space = [
+        "a.a.a", "a.a.b", "a.a.c", "a.b.a", "a.b.b", "a.b.c", "a.c.a",
+        "a.c.b", "a.c.c", "b.a.a", "b.a.b", "b.a.c", "b.b.a", "b.b.b",
+        "b.b.c", "b.c.a", "b.c.b", "b.c.c", "c.a.a", "c.a.b", "c.a.c",
+        "c.b.a", "c.b.b", "c.b.c", "c.c.a", "c.c.b", "c.c.c",
+    ]
+
+    def test_str_index(self):
+        index = StrIndex(reversed(self.space))
+        lookup = partial(strlookup, space=self.space)
+        for pattern in ["a.a.*", "a.*.a", "*.a.a", "a.*", "b.[ab].?", "b.c.c",
+                        "b.c", "*", "[c]*", "d*"]:
+            eq_(index(pattern), lookup(pattern))
+        eq_(set_evil("(a.* + b.*) = (*.b.*, *.c.*) = *.c", index),
+            set(["a.b.c", "a.c.c", "b.b.c", "b.c.c"]))
+
+    def test_str_index_update(self):
+        index = StrIndex(["b.a", "b.c"])
+        index.add("b.b")
+        index.add("b.b")
+        index.add("a.b")
+        eq_(index("b.*"), ["b.a", "b.b", "b.c"])
+        index.discard("b.a")
+        index.discard("b.a")
+        eq_(index("b.*"), ["b.b", "b.c"])
+        eq_(index("b.a"), [])
+        eq_(len(index), 3)
+
+    def test_str_index_estimate(self):
+        index = StrIndex(self.space)
+        eq_(index.estimate("a.*.b"), 9)
+        eq_(index.estimate("a.b.?"), 3)
+        eq_(index.estimate("a.b.c"), 1)
+        eq_(index.estimate("a.b"), 0)
+        eq_(index.estimate("*.a"), 27)
+        eq_(index.within("a.*.b", ["a.a.b", "b.a.b", "x"]), ["a.a.b"])
+        eq_(index.within("a.*.b", self.space), index("a.*.b"))
+
+    def make_tree(self, root, paths):
+        for path in paths:
+            d, name = os.path.split(os.path.join(root, path))
+            if not os.path.isdir(d):
+                os.makedirs(d)
+            if name:
+                open(os.path.join(d, name), "w").close()
+        # Age the directories just changed beyond the resolution of their
+        # modification times
+        now = time.time()
+        for d, _, _ in os.walk(root):
+            if os.stat(d).st_mtime > now - 30:
+                os.utime(d, (now - 60, now - 60))
+
+    def test_path_index(self):
+        tmp = mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        root = os.path.join(tmp, "root")
+        db = os.path.join(tmp, "index.db")
+        self.make_tree(root, ["a/x/", "a/y", "b/c/z", "b/d", "e"])
+        patterns = ["*", "a/*", "*/c/*", "?", "b/[cd]*", "f/*"]
+
+        index = PathIndex(root, db)
+        for pattern in patterns:
+            eq_(list(index(pattern)), list(globlookup(pattern, root)))
+        eq_(set_evil("* - b/*", index), set(["a/y", "e"]))
+        index.close()
+
+        # Only the changed directories, and new ones, are scanned again
+        os.remove(os.path.join(root, "a", "y"))
+        shutil.rmtree(os.path.join(root, "b", "c"))
+        self.make_tree(root, ["b/f/g/h"])
+        index = PathIndex(root, db, refresh=False)
+        eq_(index.refresh(), 4)
+        eq_(index.refresh(), 0)
+        for pattern in patterns + ["b/f/*"]:
+            eq_(list(index(pattern)), list(globlookup(pattern, root)))
+        eq_(list(index("*")), ["b/d", "b/f/g/h", "e"])
+        index.close()
@@ -0,0 +1,80 @@
+from functools import partial
+import pickle
+import random
+from unittest import TestCase
+
+from tests import eq_, raises
+
+from evil import op, strlookup
+from evil.dag import DAG
+from evil.materialize import MaterializedSet, Space
+from evil.set import set_evil, set_operators
+
+
+class EvilMaterializeTestCase(TestCase):
+
+    def test_materialized_set(self):
+        space = Space(["a.a", "a.b", "b.a", "b.b"])
+        view = MaterializedSet("(a.* + *.b) - b.b", space)
+        eq_(view.result, set(["a.a", "a.b"]))
+
+        changes = []
+        view.subscribe(lambda added, removed: changes.append(
+            (sorted(added), sorted(removed))))
+        space.add("c.b")
+        space.add("c.a")
+        space.update(added=["a.c", "b.b"], removed=["a.a", "x"])
+        space.discard("c.b")
+        eq_(changes, [
+            (["c.b"], []),
+            (["a.c"], ["a.a"]),
+            ([], ["c.b"]),
+        ])
+        eq_(view.result, set(["a.b", "a.c"]))
+
+        view.close()
+        space.add("a.d")
+        eq_(len(changes), 3)
+        eq_(view.result, set(["a.b", "a.c"]))
+
+    def test_materialized_set_random(self):
+        rand = random.Random(0)
+        names = ["%s.%s" % (a, b) for a in "abcd" for b in "abcd"]
+        patterns = ["a.*", "*.b", "?.[ab]", "c.c", "*", "d*"]
+        for _ in range(100):
+            expr = rand.choice(patterns)
+            for _ in range(rand.randint(0, 4)):
+                expr = "(%s) %s %s" % (expr, rand.choice("=+-,"),
+                                       rand.choice(patterns))
+            space = Space(rand.sample(names, 8))
+            view = MaterializedSet(expr, space)
+            for _ in range(10):
+                space.update(added=rand.sample(names, 2),
+                             removed=rand.sample(names, 2))
+                lookup = partial(strlookup, space=list(space))
+                eq_(view.result, set_evil(expr, lookup), expr)
+
+    def test_materialized_set_dag(self):
+        dag = DAG({"a.b": ["a.a"], "b.b": ["a.b"]})
+        view = MaterializedSet("a.* - *.b", dag)
+        eq_(view.result, set(["a.a"]))
+
+        changes = []
+        view.subscribe(lambda added, removed: changes.append(
+            (sorted(added), sorted(removed))))
+        dag.add("a.c", ["c.c", "a.a"])
+        dag.add_edge("b.b", "a.c")
+        dag.remove("a.a")
+        eq_(changes, [(["a.c"], []), ([], ["a.a"])])
+        eq_(view.result, set(["a.c"]))
+
+        # A copy of the DAG does not keep its subscribers
+        copy = pickle.loads(pickle.dumps(dag))
+        copy.add("a.d")
+        eq_(view.result, set(["a.c"]))
+        eq_(sorted(copy), ["a.b", "a.c", "a.d", "b.b", "c.c"])
+
+    @raises(ValueError)
+    def test_materialized_set_operators(self):
+        operators = [op("^", lambda s: s, right=True)] + set_operators()
+        MaterializedSet("^a", Space(), operators)
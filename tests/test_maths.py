@@ -1,8 +1,14 @@
-from unittest import TestCase
+from unittest import TestCase, skipIf
 
 from tests import eq_
 
-from evil.maths import maths_evil
+from evil.maths import (
+    maths_batch_evil,
+    maths_compile,
+    maths_evil,
+    maths_function,
+    numpy,
+)
 
 
 class EvilMathsTestCase(TestCase):
@@ -26,3 +32,52 @@ class EvilMathsTestCase(TestCase):
         eq_(maths_evil("2 ^ 8"), 256)
         eq_(maths_evil("4 * 10 + 15"), 55)
         eq_(maths_evil("4 * (10 + 15)"), 100)
+
+    def test_compile(self):
+        plan = maths_compile("a * (b + 1)")
+        for a, b, result in [(2, 3, 8), (5, 0, 5)]:
+            eq_(maths_evil(plan, {"a": a, "b": b, "1": 1}.get), result)
+
+    def test_function(self):
+        f = maths_function("a * (b + 1) - (2 ^ 3)! / c")
+        eq_(f.variables, ("a", "b", "c"))
+        eq_(f(2, 3, 40320), 7)
+        eq_(f(c=8064, b=0, a=5), 0)
+        self.assertTrue("40320" in f.source)
+
+        for expr in ["1 > 0", "2 ^ 3 * 4 / 5", "(1 <= 1) , 2", "(3 - 1)!",
+                     "1.5 * 2", "1.5 !"]:
+            result = maths_function(expr)()
+            eq_(result, maths_evil(expr))
+            eq_(type(result), type(maths_evil(expr)))
+
+        f = maths_function("x.y > if", ["if", "x.y"])
+        eq_((f(1, 2), f(2, 1)), (1, 0))
+        eq_(type(f(1, 2)), int)
+        f = maths_function("None + True - False")
+        eq_(f.variables, ("None", "True", "False"))
+        eq_(f(1, 2, 4), -1)
+        self.assertRaises(ZeroDivisionError, maths_function("a / 0"), 1)
+
+    @skipIf(numpy is None, "numpy is not installed")
+    def test_batch(self):
+        columns = {"a": [1, 2, 3, 4], "b": [4, 3, 2, 1]}
+        for expr in ["a", "(a + b)! / b", "2 ^ a * b - 1", "a > b",
+                     "a <> 2", "a <= b, 10"]:
+            rows = [
+                maths_evil(expr, lambda t: dict(zip(columns, row)).get(t, t))
+                for row in zip(*columns.values())
+            ]
+            eq_(maths_batch_evil(expr, columns).tolist(), rows)
+
+    @skipIf(numpy is None, "numpy is not installed")
+    def test_batch_power(self):
+        # Integer columns give float powers rather than overflowing
+        columns = {"a": [2, 3], "b": [-1, -2]}
+        eq_(maths_batch_evil("a ^ 70", columns).tolist(),
+            [float(2 ** 70), float(3 ** 70)])
+        eq_(maths_batch_evil("a ^ b", columns).tolist(), [0.5, 1 / 9.0])
+
+    @skipIf(numpy is None, "numpy is not installed")
+    def test_batch_constant(self):
+        eq_(maths_batch_evil("2 + 3", {"a": [1, 2, 3]}).tolist(), [5, 5, 5])
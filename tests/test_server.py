@@ -0,0 +1,96 @@
+from tempfile import mkdtemp
+from unittest import TestCase, skipIf
+import os
+import shutil
+import socket
+import threading
+
+from tests import eq_
+
+from evil.client import RemoteError, request
+from evil.server import EvilServer
+
+
+@skipIf(not hasattr(socket, "AF_UNIX"), "Unix sockets are not supported")
+class EvilServerTestCase(TestCase):
+
+    def setUp(self):
+        self.tmp = mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.root = os.path.join(self.tmp, "root")
+        for d in ["a", "b"]:
+            os.makedirs(os.path.join(self.root, d))
+            for f in ["x", "y"]:
+                open(os.path.join(self.root, d, f), "w").close()
+
+        self.path = os.path.join(self.tmp, "evil.sock")
+        self.server = EvilServer(self.path, interval=0)
+        thread = threading.Thread(target=self.server.serve_forever,
+                                  args=(0.01,))
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+    def query(self, expr, evaluator="set", budget=None):
+        return list(request(self.path, expr, evaluator, self.root, budget))
+
+    def test_server(self):
+        eq_(self.query("a/* + */y"), ["a/x", "a/y", "b/y"])
+        eq_(self.query("(2 + 2)! * 3", "maths"), [72])
+
+        # Results reflect changes to the tree
+        open(os.path.join(self.root, "b", "z"), "w").close()
+        eq_(self.query("a/* + */y"), ["a/x", "a/y", "b/y"])
+        eq_(self.query("b/*"), ["b/x", "b/y", "b/z"])
+        eq_(len(self.server.plans), 3)
+
+    def test_server_error(self):
+        with self.assertRaises(RemoteError) as context:
+            self.query("a/* +")
+        eq_(context.exception.type, "SyntaxError")
+        with self.assertRaises(RemoteError) as context:
+            self.query("1 / 0", "maths")
+        eq_(context.exception.type, "ZeroDivisionError")
+
+    def test_server_budget(self):
+        with self.assertRaises(RemoteError) as context:
+            self.query("99999999 !", "maths", {"max_magnitude": 1e100})
+        eq_(context.exception.type, "BudgetExceeded")
+        with self.assertRaises(RemoteError) as context:
+            self.query("*/*", budget={"max_size": 3})
+        eq_(context.exception.type, "BudgetExceeded")
+        eq_(self.query("*/*", budget={"max_size": 4, "timeout": 10}),
+            ["a/x", "a/y", "b/x", "b/y"])
+        with self.assertRaises(RemoteError) as context:
+            self.query("*/*", budget={"deadline": 1})
+        eq_(context.exception.type, "ValueError")
+
+    def test_server_stream(self):
+        # Values are sent as they are found, so that a client may stop
+        # reading the result early.
+        values = request(self.path, "*/* - a/y", "set", self.root)
+        eq_(next(values), "a/x")
+        values.close()
+        eq_(self.query("*/* - a/y"), ["a/x", "b/x", "b/y"])
+
+    def test_server_root(self):
+        # A root is indexed by its first lookup, outside the server's lock
+        root = self.server.root(self.root)
+        eq_(root.index, None)
+        eq_(self.query("a/*"), ["a/x", "a/y"])
+        self.assertTrue(self.server.root(self.root) is root)
+        self.assertTrue(root.index is not None)
+
+    def test_server_concurrent(self):
+        results = []
+
+        def query():
+            results.append(self.query("*/x"))
+
+        threads = [threading.Thread(target=query) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        eq_(results, [["a/x", "b/x"]] * 8)
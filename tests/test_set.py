@@ -1,12 +1,26 @@
 from functools import partial
+from itertools import count, islice
 from tempfile import mkdtemp
 from unittest import TestCase
 import os
+import threading
 
 from tests import eq_
 
-from evil import strlookup, globlookup
-from evil.set import set_evil
+import evil
+from evil import op, strlookup, globlookup, parallel_globlookup
+from evil.index import StrIndex
+from evil.set import (
+    SET_PURE,
+    Universe,
+    bitmap_set_evil,
+    inplace_set_evil,
+    planned_set_evil,
+    set_compile,
+    set_evil,
+    set_operators,
+    stream_set_evil,
+)
 
 
 class EvilSetTestCase(TestCase):
@@ -34,7 +48,7 @@ class EvilSetTestCase(TestCase):
         eq_(set_evil("(a.* + b.*) = (*.b.*, *.c.*) = *.c", lookup),
             set(["a.b.c", "a.c.c", "b.b.c", "b.c.c"]))
 
-    def test_globlookup(self):
+    def make_tree(self):
         # Create temporary files equivalent to those used in test_strlookup
         tmp = mkdtemp()
         chars = ("a", "b", "c")
@@ -46,6 +60,10 @@ class EvilSetTestCase(TestCase):
                     f = os.path.join(tmp, l1, l2, l3)
                     with open(f, "w") as fh:
                         fh.write(f)
+        return tmp
+
+    def test_globlookup(self):
+        tmp = self.make_tree()
 
         # Test the lookup
         lookup = partial(globlookup, root=tmp)
@@ -60,3 +78,222 @@ class EvilSetTestCase(TestCase):
 
         # Test the lookup within set_evil
         eq_(set_evil("a/* = */a", lookup), set(["a/a/a", "a/b/a", "a/c/a"]))
+
+    def test_globlookup_pruning(self):
+        tmp = self.make_tree()
+        listed = []
+        listdir = evil._listdir
+
+        def recording_listdir(path):
+            listed.append(os.path.relpath(path, tmp))
+            return listdir(path)
+
+        evil._listdir = recording_listdir
+        try:
+            eq_(list(globlookup("a/b/*", tmp)), ["a/b/a", "a/b/b", "a/b/c"])
+            eq_(listed, ["a/b"])
+
+            del listed[:]
+            eq_(list(globlookup("[ab]/c/?", tmp)), [
+                "a/c/a", "a/c/b", "a/c/c", "b/c/a", "b/c/b", "b/c/c",
+            ])
+            eq_(listed, [".", "a", "a/c", "b", "b/c"])
+
+            # Wildcards can match the path separator
+            eq_(list(globlookup("a?c/*", tmp)), ["a/c/a", "a/c/b", "a/c/c"])
+            eq_(list(globlookup("x/*", tmp)), [])
+        finally:
+            evil._listdir = listdir
+
+    def test_globlookup_relative(self):
+        # Patterns do not follow "." or ".." out of the root, as no listing
+        # names them.
+        tmp = self.make_tree()
+        root = os.path.join(tmp, "a")
+        for pattern in ["../*", "../b/*", "./*", "./b/*", "b/../*", "b//a"]:
+            eq_(list(globlookup(pattern, root)), [])
+            eq_(list(parallel_globlookup(pattern, root)), [])
+        eq_(list(globlookup("b/*", root)), ["b/a", "b/b", "b/c"])
+
+    def test_bitmap_set_evil(self):
+        space = [
+            "a.a.a", "a.a.b", "a.a.c", "a.b.a", "a.b.b", "a.b.c", "a.c.a",
+            "a.c.b", "a.c.c", "b.a.a", "b.a.b", "b.a.c", "b.b.a", "b.b.b",
+            "b.b.c", "b.c.a", "b.c.b", "b.c.c", "c.a.a", "c.a.b", "c.a.c",
+            "c.b.a", "c.b.b", "c.b.c", "c.c.a", "c.c.b", "c.c.c",
+        ]
+        lookup = partial(strlookup, space=space)
+        universe = Universe(space)
+        for expr in ["a.a.*", "a.a.* - a.*.a", "a.*.a - a.a.*", "x.*",
+                     "(a.* + b.*) = (*.b.*, *.c.*) = *.c"]:
+            eq_(bitmap_set_evil(expr, lookup, universe),
+                set_evil(expr, lookup))
+
+        eq_(universe.decode(universe.encode(["c.c.c", "a.a.a"])),
+            set(["a.a.a", "c.c.c"]))
+        eq_(universe.encode(5), 5)
+        eq_(universe.decode(universe.encode(iter(["new", "a.a.a"]))),
+            set(["new", "a.a.a"]))
+        eq_(len(universe), 28)
+
+    def test_planned_set_evil(self):
+        space = ["%s.%s.%s" % (a, b, c)
+                 for a in "abc" for b in "abc" for c in "abc"]
+        seen = []
+
+        def lookup(pattern):
+            seen.append(pattern)
+            return strlookup(pattern, space)
+
+        for expr in ["a.a.* = a.*.a", "(a.* + b.*) = (*.b.*, *.c.*) = *.c",
+                     "a.* - a.a.* - *.b", "x.* = a.*", "(x.* = a.*) - *"]:
+            eq_(planned_set_evil(expr, lookup), set_evil(expr, lookup))
+
+        # Lookups which cannot affect the result are skipped
+        del seen[:]
+        eq_(planned_set_evil("x.* = a.* = *", lookup), set())
+        eq_(seen, ["x.*"])
+        del seen[:]
+        eq_(planned_set_evil("(x.* - a.*), (b.b.b - (b.* = *))", lookup),
+            set())
+        eq_(seen, ["x.*", "b.b.b", "b.*", "*"])
+
+        # Intersections are evaluated smallest-first
+        del seen[:]
+        sizes = {"*": 27, "a.*": 9, "*.b": 9, "a.b.b": 1}
+        eq_(planned_set_evil("* = (a.* = *.b) = a.b.b", lookup,
+                             estimate=sizes.get),
+            set(["a.b.b"]))
+        eq_(seen, ["a.b.b", "a.*", "*.b", "*"])
+
+    def test_planned_set_evil_within(self):
+        index = StrIndex("%s.%s.%s" % (a, b, c)
+                         for a in "abc" for b in "abc" for c in "abc")
+        calls = []
+        within = index.within
+        index.within = lambda pattern, candidates: (
+            calls.append((pattern, sorted(candidates))) or
+            within(pattern, candidates))
+        eq_(planned_set_evil("(* - *.a) = a.b.*", index),
+            set(["a.b.b", "a.b.c"]))
+        eq_(calls, [("*", ["a.b.a", "a.b.b", "a.b.c"]),
+                    ("*.a", ["a.b.a", "a.b.b", "a.b.c"])])
+
+    def test_globlookup_sorted(self):
+        tmp = self.make_tree()
+        for path in ["a/a.b", "a/a-b", "a/ab", "b/a/a.b"]:
+            open(os.path.join(tmp, path), "w").close()
+        eq_(list(globlookup("[ab]/a*", tmp)), [
+            "a/a-b", "a/a.b", "a/a/a", "a/a/b", "a/a/c", "a/ab",
+            "b/a/a", "b/a/a.b", "b/a/b", "b/a/c",
+        ])
+
+    def test_parallel_globlookup(self):
+        tmp = self.make_tree()
+        for pattern in ["*", "a/*", "*/b/*", "?/[ab]/c", "d/*", "a/a/a"]:
+            expected = list(globlookup(pattern, tmp))
+            for workers in [1, 3]:
+                eq_(list(parallel_globlookup(pattern, tmp, workers,
+                                             ordered=True, maxsize=1)),
+                    expected)
+                eq_(sorted(parallel_globlookup(pattern, tmp, workers)),
+                    expected)
+
+        lookup = partial(parallel_globlookup, root=tmp)
+        eq_(set_evil("a/* = */a", lookup), set(["a/a/a", "a/b/a", "a/c/a"]))
+
+        # Threads are started once the first path is read, and stop once the
+        # reader is done with the walk.
+        before = set(threading.enumerate())
+        unread = [parallel_globlookup("*", tmp) for _ in range(5)]
+        stream_set_evil("a/* + */b/*", lookup)
+        eq_(set(threading.enumerate()) - before, set())
+        walk = parallel_globlookup("*", tmp, workers=3, maxsize=1)
+        next(walk)
+        threads = set(threading.enumerate()) - before
+        eq_(len(threads), 3)
+        walk.close()
+        for thread in threads:
+            thread.join(1)
+            self.assertFalse(thread.is_alive())
+        del unread
+
+    def test_stream_set_evil(self):
+        tmp = self.make_tree()
+        lookup = partial(globlookup, root=tmp)
+        for expr in ["a/a/*", "a/* = */a", "a/* - */a", "*/a/* + c/*",
+                     "(a/* + b/*) = (*/b/*, */c/*) = */c"]:
+            eq_(list(stream_set_evil(expr, lookup)),
+                sorted(set_evil(expr, lookup)))
+
+        # Results are found lazily, even from unending lookups
+        numbers = {"n": (0, 1), "odd": (1, 2), "big": (100, 1)}
+        lookup = lambda pattern: count(*numbers[pattern])
+        eq_(list(islice(stream_set_evil("n - odd - big", lookup), 3)),
+            [0, 2, 4])
+        eq_(list(islice(stream_set_evil("n = odd + big", lookup), 3)),
+            [1, 3, 5])
+
+    def test_stream_set_evil_unsorted(self):
+        result = stream_set_evil("a + b", {"a": [1, 3], "b": [4, 2]}.get)
+        eq_(next(result), 1)
+        eq_(next(result), 3)
+        self.assertRaises(ValueError, list, result)
+
+    def test_set_evil_limit(self):
+        tmp = self.make_tree()
+        lookup = partial(globlookup, root=tmp)
+        for expr in ["a/a/*", "a/* = */a", "a/* - */a", "*/a/* + c/*",
+                     "(a/* + b/*) = (*/b/*, */c/*) = */c"]:
+            expected = sorted(set_evil(expr, lookup))
+            eq_(set_evil(expr, lookup, order=True), expected)
+            eq_(set_evil(expr, lookup, order=True, limit=2), expected[:2])
+            eq_(set_evil(expr, lookup), set_evil(expr, lookup, limit=100))
+            result = set_evil(expr, lookup, limit=2)
+            eq_(len(result), min(2, len(expected)))
+            self.assertTrue(result <= set(expected))
+
+        # Unions stop once enough results are found, and later lookups are
+        # not made at all
+        looked_up = []
+
+        def lookup(pattern):
+            looked_up.append(pattern)
+            return count(*{"n": (0, 1), "odd": (1, 2)}[pattern])
+
+        eq_(set_evil("n, odd", lookup, limit=3), set([0, 1, 2]))
+        eq_(looked_up, ["n"])
+        eq_(set_evil("odd = n, n", lookup, limit=3, order=True), [0, 1, 2])
+
+        # Shared subexpressions, and operators which are not set methods,
+        # are evaluated too
+        plan = set_compile("(a, b) = (a, b), (a, b) - c").share(SET_PURE)
+        eq_(set_evil(plan, set, order=True), ["a", "b"])
+        operators = [op("^", set.symmetric_difference)] + set_operators()
+        eq_(set_evil("abc ^ bcd, e", set, operators, limit=2, order=True),
+            ["a", "d"])
+        self.assertRaises(ValueError, set_evil, "a", set, limit=1, cast=list)
+
+    def test_inplace_set_evil(self):
+        space = {"a": set("abc"), "b": set("bcd"), "c": set("cde"),
+                 "d": set("d")}
+        for expr in ["a", "a + b", "(a + b) = c", "a - (b - c)",
+                     "(a, b) - (d = c) + a", "a = a"]:
+            eq_(inplace_set_evil(expr, space.get), set_evil(expr, space.get))
+        eq_(space["a"], set("abc"))
+
+        # Fresh sets from the lookup are modified rather than copied
+        fresh = {}
+
+        def lookup(pattern):
+            fresh[pattern] = set(space[pattern])
+            return fresh[pattern]
+
+        result = inplace_set_evil("(a + d) = b", lookup, fresh=True)
+        eq_(result, set("bcd"))
+        self.assertTrue(any(result is s for s in fresh.values()))
+
+        # Intersections update their smaller operand, which holds the result
+        result = inplace_set_evil("(a + c) = b", lookup, fresh=True)
+        eq_(result, set("bcd"))
+        self.assertTrue(result is fresh["b"])
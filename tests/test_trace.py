@@ -0,0 +1,39 @@
+from itertools import count
+from unittest import TestCase
+
+from tests import eq_
+
+from evil.set import SET_PURE, set_compile, set_evil
+from evil.trace import Stats
+
+
+class EvilTraceTestCase(TestCase):
+
+    def test_stats(self):
+        stats = Stats(timer=count().next)
+        result = set_evil("(abc = bc) + (cd - d), abc", set, pure=SET_PURE,
+                          tracer=stats)
+        eq_(result, set("abc"))
+
+        snapshot = stats.snapshot(reset=True)
+        eq_(snapshot["compilations"], 1)
+        self.assertTrue(snapshot["tokenize_time"] > 0)
+        self.assertTrue(snapshot["parse_time"] > 0)
+        eq_(sorted(snapshot["lookups"]), ["abc", "bc", "cd", "d"])
+        eq_(snapshot["lookups"]["abc"], {
+            "count": 1, "time": 1, "max_time": 1, "size": 3, "max_size": 3,
+        })
+        eq_(dict((token, totals["count"])
+                 for token, totals in snapshot["operators"].items()),
+            {"=": 1, "+": 1, "-": 1, ",": 1})
+        eq_(snapshot["operators"]["="]["size"], 2)
+        eq_(snapshot["reductions"]["count"], 3)
+        eq_(snapshot["peak_size"], 3)
+        eq_(stats.snapshot()["lookups"], {})
+
+    def test_stats_hottest(self):
+        plan = set_compile("a, b, c")
+        times = iter([0, 1, 1, 4, 4, 6])
+        stats = Stats(timer=lambda: next(times, 6))
+        set_evil(plan, set, tracer=stats)
+        eq_([pattern for pattern, totals in stats.hottest(2)], ["b", "c"])